@@ -0,0 +1,78 @@
+"""
+Cost of a decision, for each agent and for the recommenders wrapping them.
+"""
+
+import itertools
+
+import pytest
+
+from utils.adaptive_recommendations import (
+    ArrayBadSeedRecommender,
+    BadSeedRecommender,
+    CheatingAgent,
+    NaiveAgent,
+    RLAgent,
+)
+
+AGENTS = {
+    "naive": NaiveAgent,
+    "cheating": CheatingAgent,
+    "rl-numpy": lambda n: RLAgent(n, "bluesky-tutorial", backend="numpy"),
+    "rl-numpy-table": lambda n: RLAgent(
+        n, "bluesky-tutorial", backend="numpy", max_count=10
+    ),
+    "rl-tensorflow": lambda n: RLAgent(n, "bluesky-tutorial"),
+}
+
+
+@pytest.fixture(params=list(AGENTS))
+def agent(request, rack_size):
+    if request.param == "rl-tensorflow":
+        pytest.importorskip("tensorforce")
+    return AGENTS[request.param](rack_size)
+
+
+def bench_agent_call(benchmark, agent):
+    states = itertools.cycle(
+        [(x, badness) for x in range(agent.num_samples) for badness in (0, 3)]
+    )
+
+    def decide():
+        agent(*next(states))
+
+    benchmark(decide)
+
+
+@pytest.fixture(params=[BadSeedRecommender, ArrayBadSeedRecommender])
+def recommender(request, rack_size):
+    """A recommender that has already seen every sample once."""
+    recommender = request.param(num_samples=rack_size, agent=CheatingAgent(rack_size))
+    for x in range(rack_size):
+        recommender.tell(x, (1000.0 if x % 3 else 10.0,))
+    return recommender
+
+
+def _readings(num_samples):
+    return itertools.cycle(
+        [(x, (1000.0 if x % 3 else 10.0,)) for x in range(num_samples)]
+    )
+
+
+def bench_recommender_tell(benchmark, recommender):
+    readings = _readings(recommender.num_samples)
+
+    def tell():
+        recommender.tell(*next(readings))
+
+    benchmark(tell)
+
+
+@pytest.mark.parametrize("n", [1, 10])
+def bench_recommender_tell_ask(benchmark, recommender, n):
+    readings = _readings(recommender.num_samples)
+
+    def tell_ask():
+        recommender.tell(*next(readings))
+        recommender.ask(n, tell_pending=False)
+
+    benchmark(tell_ask)
@@ -0,0 +1,35 @@
+"""
+Step cost of the CartSeed environments as the number of seeds grows.
+
+The per-step cost should stay flat from 10 to 10^5 seeds.
+"""
+
+import pytest
+
+pytest.importorskip("tensorforce")
+
+from utils.tf_agent import CartSeed, CartSeedCountdown  # noqa: E402
+
+SEED_COUNTS = [10, 1_000, 10_000, 100_000]
+
+
+@pytest.mark.parametrize("revisiting", [True, False])
+@pytest.mark.parametrize("seed_count", SEED_COUNTS)
+@pytest.mark.parametrize("env_class", [CartSeed, CartSeedCountdown])
+def bench_execute_random_move(benchmark, env_class, seed_count, revisiting):
+    env = env_class(seed_count, bad_seed_count=seed_count // 2, revisiting=revisiting)
+    env.reset()
+
+    def step():
+        # Start over before a non-revisiting episode runs out of seeds.
+        if env.timestep >= seed_count - 2:
+            env.reset()
+        env.execute(1)
+
+    benchmark(step)
+
+
+@pytest.mark.parametrize("seed_count", SEED_COUNTS)
+def bench_reset(benchmark, seed_count):
+    env = CartSeed(seed_count, bad_seed_count=seed_count // 2)
+    benchmark(env.reset)
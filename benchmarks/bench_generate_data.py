@@ -0,0 +1,34 @@
+"""
+Cost of simulating samples and exposures as the detector grows.
+"""
+
+import numpy as np
+
+from utils.generate_data import (
+    NoiseGenerator,
+    SampleLibrary,
+    generate_ideal_image,
+    generate_measured_image,
+    make_random_peaks,
+    x,
+)
+
+
+def bench_make_random_peaks(benchmark):
+    rng = np.random.default_rng(0)
+    benchmark(make_random_peaks, x, rng=rng)
+
+
+def bench_generate_ideal_image(benchmark, shape):
+    intensity = make_random_peaks(x, rng=np.random.default_rng(0)) * 1000
+    # the first call builds the cached geometry, which is not what is measured
+    generate_ideal_image(x, intensity, shape)
+    benchmark(generate_ideal_image, x, intensity, shape)
+
+
+def bench_generate_measured_image(benchmark, shape):
+    library = SampleLibrary(shape=shape, seed=0)
+    noise = NoiseGenerator(shape, seed=0)
+    out = np.empty(shape)
+    library.ideal_pattern(0)
+    benchmark(generate_measured_image, 0, out=out, noise=noise, library=library)
@@ -0,0 +1,24 @@
+"""
+Cost of a simulated exposure, with the exposure time itself set to 0.
+"""
+
+import pytest
+
+from utils.generate_data import NoiseGenerator, SampleLibrary
+from utils.simulated_hardware import DiffractionDetector, SimulatedMotor
+
+
+@pytest.mark.parametrize("reduced_only", [False, True])
+def bench_detector_trigger(benchmark, shape, reduced_only):
+    motor = SimulatedMotor(value=0, name="sample_selector")
+    det = DiffractionDetector(name="detector", sample_selector=motor)
+    det.library = SampleLibrary(shape=shape, seed=0)
+    det.noise = NoiseGenerator(shape, seed=0)
+    det.delay = 0
+    det.reduced_only = reduced_only
+    det.trigger().wait()
+
+    def trigger():
+        det.trigger().wait()
+
+    benchmark(trigger)
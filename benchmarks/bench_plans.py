@@ -0,0 +1,61 @@
+"""
+Shots per second of the whole plan on simulated hardware with no exposure time,
+i.e. everything the RunEngine, the recommender and the detector spend per shot.
+"""
+
+from bluesky import RunEngine
+import pytest
+
+from utils.adaptive_recommendations import (
+    CheatingAgent,
+    NaiveAgent,
+    bad_seed_plan,
+    with_agent,
+)
+from utils.generate_data import NoiseGenerator, SampleLibrary
+from utils.orchestration import Rack
+from utils.simulated_hardware import detector
+
+MAX_SHOTS = 30
+
+
+@pytest.fixture
+def RE():
+    return RunEngine(context_managers=[])
+
+
+@pytest.fixture
+def zero_delay():
+    delay, detector.delay = detector.delay, 0
+    yield
+    detector.delay = delay
+
+
+@pytest.mark.parametrize("pipelined", [False, True], ids=["serial", "pipelined"])
+@pytest.mark.parametrize("agent_class", [NaiveAgent, CheatingAgent])
+def bench_with_agent(benchmark, RE, zero_delay, agent_class, pipelined):
+    def run():
+        RE(with_agent(agent_class(9), MAX_SHOTS, pipelined=pipelined))
+
+    benchmark.pedantic(run, rounds=5, warmup_rounds=1)
+
+
+@pytest.mark.parametrize("pipelined", [False, True], ids=["serial", "pipelined"])
+def bench_bad_seed_plan(benchmark, RE, rack_size, shape, pipelined):
+    rack = Rack("rack", SampleLibrary(rack_size, shape, seed=0), delay=0)
+    rack.detector.noise = NoiseGenerator(shape, seed=0)
+
+    def run():
+        RE(
+            bad_seed_plan(
+                rack.sample_selector,
+                rack.detector,
+                "rack_detector_signal_to_noise",
+                list(range(rack_size)),
+                CheatingAgent(rack_size),
+                MAX_SHOTS,
+                pipelined=pipelined,
+            )
+        )
+
+    benchmark.pedantic(run, rounds=5, warmup_rounds=1)
@@ -0,0 +1,21 @@
+"""
+Sizes shared by the benchmarks.
+
+Rack sizes go from the tutorial's 9 samples to a full robot magazine, and
+detector shapes from the tutorial's 128x128 to a 1 megapixel panel.
+"""
+
+import pytest
+
+RACK_SIZES = [9, 96, 1536]
+SHAPES = [(128, 128), (512, 512), (1024, 1024)]
+
+
+@pytest.fixture(params=RACK_SIZES, ids=lambda n: f"rack{n}")
+def rack_size(request):
+    return request.param
+
+
+@pytest.fixture(params=SHAPES, ids=lambda shape: "x".join(map(str, shape)))
+def shape(request):
+    return request.param
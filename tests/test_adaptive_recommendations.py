@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from utils.adaptive_recommendations import (
+    ArrayBadSeedRecommender,
+    BadSeedRecommender,
+    CheatingAgent,
+    NaiveAgent,
+    RLAgent,
+)
+
+
+@pytest.mark.parametrize("backend", ["numpy", "tensorflow"])
+@pytest.mark.parametrize("max_count", [None, 3])
+def test_rl_agent_act_batch(backend, max_count):
+    if backend == "tensorflow":
+        pytest.importorskip("tensorforce")
+    agent = RLAgent(9, "bluesky-tutorial", backend=backend, max_count=max_count)
+    xs = np.arange(9)
+    ys = np.array([0, 1, 0, 3, 10, 0, 2, 7, 0])
+    # batches take the policy's most likely action
+    expected = [(x + agent._act(y, deterministic=True)) % 9 for x, y in zip(xs, ys)]
+    np.testing.assert_array_equal(agent.act_batch(xs, ys), expected)
+    if max_count is not None:
+        assert agent.action_table == [
+            agent._act(badness, deterministic=True) for badness in range(max_count + 1)
+        ]
+
+
+@pytest.mark.parametrize("agent_cls", [NaiveAgent, CheatingAgent])
+def test_array_recommender_matches_bad_seed_recommender(agent_cls):
+    reference = BadSeedRecommender(5, agent_cls(5))
+    recommender = ArrayBadSeedRecommender(5, agent_cls(5))
+    snrs = [600, 10, 700, 20, 30]
+    x = 0
+    for _ in range(40):
+        reference.tell(x, (snrs[x],))
+        recommender.tell(x, (snrs[x],))
+        assert recommender.next_point == reference.next_point
+        x = reference.next_point
+    expected = [reference.target_count(snr) for snr in snrs]
+    np.testing.assert_array_equal(recommender.targets, expected)
+
+
+def test_array_recommender_uses_target_count():
+    class Recommender(ArrayBadSeedRecommender):
+        @staticmethod
+        def target_count(snr):
+            return 3
+
+    recommender = Recommender(2, NaiveAgent(2))
+    recommender.tell_many([0, 1], [(1,), (1,)])
+    np.testing.assert_array_equal(recommender.targets, [3, 3])
+    assert recommender.completion_fraction == pytest.approx(2 / 6)
+
+
+def test_array_recommender_empty_rack():
+    recommender = ArrayBadSeedRecommender(0, NaiveAgent(0))
+    assert recommender.completion_fraction == 1.0
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from utils.generate_data import SampleLibrary, generate_ideal_image, radial_geometry
+from utils.reduction import radial_reducer
+from utils.simulated_hardware import DiffractionDetector, SimulatedMotor
+
+x = np.linspace(0, 30, num=101)
+
+
+@pytest.mark.parametrize("shape", [(127, 127), (128, 99), (65, 64)])
+def test_odd_shapes_render_on_the_even_grid(shape):
+    expected = (2 * (shape[0] // 2), 2 * (shape[1] // 2))
+    assert radial_geometry(x, shape).shape == expected
+    image = generate_ideal_image(x, np.ones(len(x)), shape)
+    assert image.shape == expected
+
+    reducer = radial_reducer(x, shape)
+    assert reducer.shape == expected
+    profile, _ = reducer.reduce(image)
+    assert profile.shape == (len(x),)
+
+
+@pytest.mark.parametrize("reduced_only", [False, True])
+def test_detector_with_odd_shape(reduced_only):
+    motor = SimulatedMotor(value=0, name="sample_selector")
+    det = DiffractionDetector(name="detector", sample_selector=motor)
+    det.library = SampleLibrary(num_samples=2, shape=(127, 127), seed=0)
+    det.delay = 0
+    det.estimate_snr = True
+    det.reduced_only = reduced_only
+    det.trigger().wait()
+    if not reduced_only:
+        assert det.image.get().shape == (126, 126)
@@ -0,0 +1,10 @@
+from utils.model_registry import CHECKPOINTS, registry, warm
+
+
+def test_warm_preloads_shipped_checkpoints():
+    futures = warm(backend="numpy")
+    assert len(futures) == len(CHECKPOINTS)
+    for future in futures:
+        future.result()
+    for checkpoint in CHECKPOINTS:
+        assert registry.is_loaded(checkpoint, backend="numpy")
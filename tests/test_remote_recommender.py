@@ -0,0 +1,21 @@
+import pytest
+
+from utils.adaptive_recommendations import NaiveAgent
+from utils.remote_recommender import RemoteRecommender, agent_factory
+
+
+def test_agent_instance_is_copied_to_the_worker():
+    with RemoteRecommender(5, agent_factory(NaiveAgent(5)), timeout=10) as remote:
+        assert remote.wait_ready(timeout=60)
+        remote.tell_many([0], [(1,)])
+        assert remote.ask(1) == (1,)
+        assert remote.answered == 1
+
+
+def test_worker_failing_to_start_raises():
+    # an agent where a factory is expected
+    with RemoteRecommender(5, NaiveAgent(5)) as remote:
+        with pytest.raises(RuntimeError, match="failed to start"):
+            remote.wait_ready(timeout=60)
+        with pytest.raises(RuntimeError, match="failed to start"):
+            remote.ask(1)
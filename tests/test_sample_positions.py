@@ -0,0 +1,26 @@
+import numpy as np
+
+from utils.sample_positions import SamplePositions
+
+
+def test_integer_positions_stay_integers():
+    positions = SamplePositions(range(9))
+    assert positions.to_position(3) == 3
+    assert type(positions.to_position(3)) is int
+    assert type(positions.to_position(3, axis=0)) is int
+    assert positions.to_index(2.9) == 3
+
+
+def test_float_positions():
+    positions = SamplePositions([0.0, 1.5, 3.0])
+    assert type(positions.to_position(1)) is float
+    assert positions.to_position(1) == 1.5
+
+
+def test_plate_positions():
+    plate = [(x, y) for y in range(2) for x in range(3)]
+    positions = SamplePositions(plate)
+    np.testing.assert_array_equal(positions.to_position(4), [1, 1])
+    assert positions.to_position(4).dtype.kind == "i"
+    assert type(positions.to_position(4, axis=1)) is int
+    assert positions.to_index([2.1, 0.9]) == 5
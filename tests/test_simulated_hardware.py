@@ -0,0 +1,18 @@
+from bluesky import RunEngine
+
+from utils.simulated_hardware import time_warp
+
+
+def test_time_warp_restores_dispatcher_process():
+    RE = RunEngine({})
+    with time_warp(RE):
+        pass
+    assert "process" not in vars(RE.dispatcher)
+
+    def process(name, doc):
+        pass
+
+    RE.dispatcher.process = process
+    with time_warp(RE):
+        assert RE.dispatcher.process is not process
+    assert RE.dispatcher.process is process
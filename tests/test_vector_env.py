@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from utils.vector_env import VectorCartSeed, VectorCartSeedCountdown
+
+tf_agent = pytest.importorskip("utils.tf_agent")
+
+SEED_COUNT = 9
+BAD_SEED_COUNT = 3
+
+
+def make_envs(scalar_cls, vector_cls, revisiting):
+    # sequential moves, so both take the same path without sharing random draws
+    kwargs = dict(
+        bad_seed_count=BAD_SEED_COUNT,
+        frozen_order=True,
+        revisiting=revisiting,
+    )
+    scalar = scalar_cls(SEED_COUNT, **kwargs)
+    scalar.rng = np.random.default_rng(0)
+    vector = vector_cls(1, SEED_COUNT, seed=0, **kwargs)
+    scalar.reset()
+    vector.reset()
+    scalar.current_idx = vector.current_idx[0] = 4
+    return scalar, vector
+
+
+def assert_same_steps(scalar, vector, steps):
+    actions = np.random.default_rng(1).integers(2, size=steps)
+    for action in actions:
+        # copy, as CartSeed hands back a view of its seeds
+        state, terminal, reward = scalar.execute(action)
+        state = np.array(state)
+        states, terminals, rewards = vector.execute([action])
+        np.testing.assert_array_equal(states[0], state)
+        assert terminals[0] == terminal
+        assert rewards[0] == pytest.approx(reward)
+        np.testing.assert_array_equal(vector.seeds[0], scalar.seeds)
+
+
+@pytest.mark.parametrize("revisiting", [True, False])
+def test_vector_cart_seed_matches_cart_seed(revisiting):
+    scalar, vector = make_envs(tf_agent.CartSeed, VectorCartSeed, revisiting)
+    np.testing.assert_array_equal(vector.seeds[0], scalar.seeds)
+    # past the end of the episode too
+    assert_same_steps(scalar, vector, steps=2 * scalar.max_episode_timesteps())
+
+
+@pytest.mark.parametrize("revisiting", [True, False])
+def test_vector_cart_seed_countdown_matches_cart_seed_countdown(revisiting):
+    scalar, vector = make_envs(
+        tf_agent.CartSeedCountdown, VectorCartSeedCountdown, revisiting
+    )
+    # the countdowns are random, so start the vector env from the scalar's
+    assert vector.reward_scale[0] == pytest.approx(100 / vector.seeds[0, :, 1].sum())
+    vector.seeds[0] = scalar.seeds
+    vector.total_max_count[0] = scalar.total_max_count
+    vector.reward_scale[0] = 100 / scalar.total_max_count
+    assert_same_steps(scalar, vector, steps=2 * int(scalar.max_episode_timesteps()))
@@ -0,0 +1,137 @@
+from matplotlib.backend_bases import MouseEvent
+from matplotlib.figure import Figure
+import numpy as np
+import pytest
+
+from utils import visualization
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeTimer:
+    def __init__(self, interval):
+        self.interval = interval
+        self.callbacks = []
+        self.started = False
+
+    def add_callback(self, func):
+        self.callbacks.append(func)
+
+    def start(self):
+        self.started = True
+
+    def stop(self):
+        self.started = False
+
+    def fire(self):
+        for func in self.callbacks:
+            func()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(visualization, "time", clock)
+    return clock
+
+
+def run_shots(callback, clock, shots, interval):
+    """One run with a single event per shot, as bad_seed_plan does."""
+    event = {"data": {"sample_selector": 0, "detector_image": None}}
+    for _ in range(shots):
+        callback("start", {})
+        callback("event", event)
+        callback("stop", {})
+        clock.now += interval
+
+
+def test_single_event_runs_are_throttled(clock):
+    redraws = []
+    callback = visualization._throttled_callback(
+        lambda *args: None, lambda: redraws.append(clock.now), max_fps=2
+    )
+    run_shots(callback, clock, shots=48, interval=0.125)
+    # 6 seconds at 2 frames per second
+    assert len(redraws) == 12
+    callback.flush()
+    assert len(redraws) == 13
+
+
+def test_held_back_redraw_is_left_to_a_timer(clock):
+    redraws = []
+    timers = []
+
+    def new_timer(interval):
+        timers.append(FakeTimer(interval))
+        return timers[-1]
+
+    callback = visualization._throttled_callback(
+        lambda *args: None, lambda: redraws.append(clock.now), 2, new_timer
+    )
+    run_shots(callback, clock, shots=3, interval=0.125)
+    assert len(redraws) == 1
+    # one pending timer however many runs stop before it fires
+    assert len(timers) == 1
+    assert timers[0].started
+    assert timers[0].interval == 501
+    timers[0].fire()
+    assert len(redraws) == 2
+    assert not timers[0].started
+
+
+def mosaic(num_samples=4, **kwargs):
+    fig = Figure()
+    draws = []
+    fig.canvas.draw_idle = lambda: draws.append(None)
+    callback = visualization.stream_to_mosaic(fig, num_samples, **kwargs)
+    return fig, callback, draws
+
+
+def shot(callback, sample, img):
+    callback("start", {})
+    data = {"sample_selector": sample, "detector_image": img}
+    callback("event", {"data": data})
+    callback("stop", {})
+
+
+def test_mosaic_single_event_runs_are_throttled(clock):
+    fig, callback, draws = mosaic(max_fps=2)
+    img = np.random.default_rng(0).random((64, 64))
+    for i in range(48):
+        shot(callback, i % 4, img)
+        clock.now += 0.125
+    assert len(draws) == 12
+
+
+def test_mosaic_image_smaller_than_tile():
+    fig, callback, draws = mosaic(tile_shape=(32, 32))
+    shot(callback, 1, np.random.default_rng(0).random((20, 40)))
+    mosaic_im = fig.axes[0].images[0]
+    tile = np.asarray(mosaic_im.get_array())[:32, 32:64]
+    assert np.isfinite(tile[:20, :32]).all()
+    assert np.isnan(tile[20:]).all()
+
+
+def test_mosaic_detail_of_unmeasured_sample_is_blank():
+    fig, callback, draws = mosaic(tile_shape=(32, 32))
+    shot(callback, 0, np.random.default_rng(0).random((64, 64)))
+    mosaic_ax, detail_ax = fig.axes
+    detail = detail_ax.images[0]
+
+    def click(x, y):
+        display_x, display_y = mosaic_ax.transData.transform((x, y))
+        event = MouseEvent("button_press_event", fig.canvas, display_x, display_y)
+        event.inaxes = mosaic_ax
+        fig.canvas.callbacks.process(event.name, event)
+
+    click(10, 10)
+    assert np.isfinite(np.asarray(detail.get_array())).all()
+    click(40, 10)
+    assert detail_ax.get_title() == "Sample 1 N_shots: 0"
+    assert np.isnan(np.asarray(detail.get_array())).all()
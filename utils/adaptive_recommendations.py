@@ -1,5 +1,10 @@
 from collections import Counter
+import inspect
+import itertools
+import uuid
 
+import bluesky.plan_stubs as bps
+import bluesky.preprocessors as bpp
 from bluesky_adaptive.recommendations import NoRecommendation
 from bluesky_adaptive.per_start import adaptive_plan
 from bluesky_adaptive.on_stop import recommender_factory
@@ -8,6 +13,7 @@ from bluesky_widgets.utils.streaming import stream_documents_into_runs
 import matplotlib.pyplot as plt
 import numpy as np
 
+from .sample_positions import SamplePositions
 from .simulated_hardware import detector, sample_selector, SHAPE
 from .visualization import stream_to_figures
 
@@ -25,6 +31,25 @@ class BadSeedRecommender:
         self.seen_count = Counter()
         self.seen_snr = dict()
         self.agent = agent
+        # Predicted points starting at next_point, see ask
+        self.plan = []
+        # Points handed out by ask that have no reading yet, oldest first
+        self.pending = []
+
+    @staticmethod
+    def target_count(snr):
+        """How many shots a sample with this SNR needs in total."""
+        if snr > 500:
+            return 10
+        else:
+            return 1
+
+    def _recommend(self, x, count, snr):
+        """Where to go after the count-th shot on x."""
+        if count == 1:
+            return (x + 1) % self.num_samples
+        else:
+            return self.agent(x, max(self.target_count(snr) - count, 0))
 
     def tell(self, x, y):
         """Tell the recommnder about something new"""
@@ -32,27 +57,177 @@ class BadSeedRecommender:
         self.seen_count[x] += 1
         (snr,) = y
         self.seen_snr[x] = float(snr)
-        if snr > 500:
-            target = 10
+        self.next_point = self._recommend(x, self.seen_count[x], snr)
+        self._update_plan([x])
+        self._update_pending([x])
+
+    def _update_plan(self, xs):
+        """Keep the rest of the plan only if these readings played out as predicted."""
+        if self.plan[: len(xs) + 1] == [*xs, self.next_point]:
+            del self.plan[: len(xs)]
         else:
-            target = 1
-        if self.seen_count[x] == 1:
-            self.next_point = (x + 1) % self.num_samples
+            self.plan = []
+
+    def _update_pending(self, xs):
+        """Drop the pending points these readings are for."""
+        if self.pending[: len(xs)] == list(xs):
+            del self.pending[: len(xs)]
         else:
-            self.next_point = self.agent(x, max(target - self.seen_count[x], 0))
+            # readings out of step with what was asked for, start over
+            self.pending = []
+
+    def tell_pending(self, xs):
+        """
+        Tell the recommender that points are being measured, without readings yet.
+
+        The next `ask` carries on from after them. Their readings are expected
+        to follow through `tell`, in the same order.
+        """
+        self.pending.extend(xs)
 
     def tell_many(self, xs, ys):
         for x, y in zip(xs, ys):
             self.tell(x, y)
 
+    def _plan_ahead(self, n):
+        """
+        Roll the agent forward from next_point, assuming every predicted shot
+        reads the same SNR as the last shot on that sample. Samples without a
+        reading yet are assumed to need no more than the one shot.
+
+        Pending points are rolled over as if measured, and are not part of the
+        returned plan.
+        """
+        plan = [*self.pending] or [self.next_point]
+        skip = len(self.pending)
+        predicted = Counter(plan[:-1])
+        while len(plan) < n + skip:
+            x = plan[-1]
+            predicted[x] += 1
+            count, snr = self._seen(x)
+            plan.append(self._recommend(x, count + predicted[x], snr))
+        return plan[skip:]
+
+    def _seen(self, x):
+        """Number of shots on sample x so far and the SNR of the last one (or 0)."""
+        return self.seen_count[x], self.seen_snr.get(x, 0)
+
     def ask(self, n, tell_pending=True):
-        """Ask the recommender for a new command"""
-        if n != 1:
-            raise NotImplementedError
-        if self.next_point is None or self.next_point >= self.num_samples:
+        """
+        Ask the recommender for the next n sample indices.
+
+        With n > 1 the following points are a prediction, which is revised
+        whenever a `tell` does not match it. With tell_pending the points are
+        recorded as pending (see `tell_pending`), so asking again before their
+        readings arrive gives the points after them.
+        """
+        if self.pending:
+            points = self._plan_ahead(n)
+        else:
+            if self.next_point is None:
+                raise NoRecommendation
+            if len(self.plan) < n:
+                self.plan = self._plan_ahead(n)
+            points = self.plan[:n]
+        if points[0] >= self.num_samples:
             raise NoRecommendation
+        if tell_pending:
+            self.tell_pending(points)
+        return tuple(points)
+
+
+class ArrayBadSeedRecommender(BadSeedRecommender):
+    """
+    BadSeedRecommender backed by preallocated arrays, for large racks and replays.
+
+    Per-sample shot counts, last and mean SNR and target counts are NumPy arrays,
+    `tell_many` ingests a whole batch of readings with array operations, and the
+    rack-wide summaries are kept up to date so that polling them is O(1).
+    Recommendations are the same as BadSeedRecommender's.
+    """
+
+    def __init__(self, num_samples, agent):
+        super().__init__(num_samples, agent)
+        # kept in the arrays below instead, see _seen
+        del self.seen_count, self.seen_snr
+        self.counts = np.zeros(num_samples, dtype=int)
+        self.last_snr = np.full(num_samples, np.nan)
+        self.snr_sum = np.zeros(num_samples)
+        # Until it is measured, a sample is assumed to need one shot.
+        self.targets = np.ones(num_samples, dtype=int)
+        self.total_shots = 0
+        self._useful_shots = 0  # sum(min(counts, targets))
+        self._needed_shots = num_samples  # sum(targets)
+
+    def _seen(self, x):
+        snr = self.last_snr[x]
+        return self.counts[x], 0 if np.isnan(snr) else snr
+
+    def tell(self, x, y):
+        """Tell the recommnder about something new"""
+        self.tell_many([x], [y])
 
-        return (self.next_point,)
+    def tell_many(self, xs, ys):
+        """Tell the recommender about a batch of readings, in order."""
+        xs = np.asarray(xs, dtype=int).ravel()
+        if not len(xs):
+            return
+        snr = np.asarray(ys, dtype=float).reshape(len(xs), -1)[:, 0]
+
+        affected = np.unique(xs)
+        self._useful_shots -= np.minimum(
+            self.counts[affected], self.targets[affected]
+        ).sum()
+        self._needed_shots -= self.targets[affected].sum()
+
+        np.add.at(self.counts, xs, 1)
+        np.add.at(self.snr_sum, xs, snr)
+        self.total_shots += len(xs)
+        # the last reading of each sample sets its SNR and target
+        reversed_xs, reversed_first = np.unique(xs[::-1], return_index=True)
+        last_snr = snr[len(xs) - 1 - reversed_first]
+        self.last_snr[reversed_xs] = last_snr
+        self.targets[reversed_xs] = [self.target_count(value) for value in last_snr]
+
+        self._useful_shots += np.minimum(
+            self.counts[affected], self.targets[affected]
+        ).sum()
+        self._needed_shots += self.targets[affected].sum()
+
+        x = int(xs[-1])
+        self.next_point = self._recommend(x, self.counts[x], snr[-1])
+        self._update_plan(xs.tolist())
+        self._update_pending(xs.tolist())
+
+    @property
+    def mean_snr(self):
+        """Mean SNR of each sample, NaN for samples not measured yet."""
+        with np.errstate(invalid="ignore"):
+            return np.where(self.counts > 0, self.snr_sum / self.counts, np.nan)
+
+    def remaining_shots(self, x=None):
+        """Useful shots left on sample x, or on every sample if x is None."""
+        if x is None:
+            return np.maximum(self.targets - self.counts, 0)
+        return max(self.targets[x] - self.counts[x], 0)
+
+    @property
+    def useful_shots(self):
+        """Shots that went towards a sample's target."""
+        return int(self._useful_shots)
+
+    @property
+    def wasted_shots(self):
+        """Shots beyond a sample's target."""
+        return self.total_shots - self.useful_shots
+
+    @property
+    def completion_fraction(self):
+        """Fraction of the rack's (currently known) target shots taken."""
+        if not self._needed_shots:
+            # an empty rack
+            return 1.0
+        return self._useful_shots / self._needed_shots
 
 
 class NaiveAgent:
@@ -73,6 +248,10 @@ class NaiveAgent:
         # print(f"called {x}, {y}")
         return (x + 1) % self.num_samples
 
+    def act_batch(self, xs, ys):
+        """Vectorized __call__ over arrays of positions and badness."""
+        return (np.asarray(xs) + 1) % self.num_samples
+
 
 class CheatingAgent:
     """A simple naive agent that cycles samples sequentially in environment space"""
@@ -95,9 +274,14 @@ class CheatingAgent:
         else:
             return (x + 1) % self.num_samples
 
+    def act_batch(self, xs, ys):
+        """Vectorized __call__ over arrays of positions and badness."""
+        xs = np.asarray(xs)
+        return np.where(np.asarray(ys) > 0, xs, (xs + 1) % self.num_samples)
+
 
 class RLAgent:
-    def __init__(self, num_samples, path):
+    def __init__(self, num_samples, path, *, backend="tensorflow", max_count=None):
         """
 
         Parameters
@@ -105,14 +289,69 @@ class RLAgent:
         num_samples : int
             Total number of samples in the "environment" space
         path : Path, str
-            Output path of agent to load from
+            Output path of agent to load from, or a name registered in
+            `utils.model_registry.CHECKPOINTS` such as "bluesky-tutorial"
+        backend : {"tensorflow", "numpy"}
+            "tensorflow" restores the full tensorforce agent. "numpy" runs the
+            policy exported by `utils.numpy_policy.export_policy` instead, without
+            importing TensorFlow.
+        max_count : int, None
+            If given, the action for every badness from 0 to max_count is computed
+            once here and later answered from a table. Other values still go
+            through the network.
         """
-        from .tf_agent import load_agent
-        import tensorflow as tf
-        tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
-
         self.num_samples = num_samples
-        self.agent = load_agent(path)
+        self.backend = backend
+        self.max_count = max_count
+        self.load(path)
+
+    def load(self, path):
+        """
+        Switch to the agent saved at path.
+
+        Agents are shared through `utils.model_registry.registry`, so this is free
+        for a checkpoint that was loaded (or preloaded) before, which makes it
+        cheap to swap checkpoints between runs.
+        """
+        from .model_registry import registry
+
+        self.agent = registry.get(path, backend=self.backend)
+        self.path = path
+        self.action_table = None
+        if self.max_count is not None:
+            # the most likely actions, rather than one sample of the policy
+            self.action_table = [
+                self._act(badness, deterministic=True)
+                for badness in range(self.max_count + 1)
+            ]
+
+    def _act(self, badness, **kwargs):
+        state = [float(bool(badness)), float(badness)]
+        return self.agent.act(state, independent=True, **kwargs)
+
+    def _act_batch(self, badness):
+        if not badness.size:
+            return np.zeros(badness.shape, dtype=int)
+        states = np.stack([badness != 0, badness], axis=-1).astype(np.float32)
+        if self.backend == "numpy":
+            return np.asarray(self.agent.act(states, independent=True))
+        # tensorforce batches a list of states, one per parallel environment,
+        # into a single forward pass; an array would be read as one state.
+        actions = self.agent.act(
+            states.reshape(-1, 2).tolist(),
+            parallel=list(range(badness.size)),
+            independent=True,
+            deterministic=True,
+        )
+        return np.asarray(actions, dtype=int).reshape(badness.shape)
+
+    def change(self, badness):
+        """Whether to move on (1) or stay (0) given the useful counts remaining."""
+        if self.action_table is not None:
+            index = int(badness)
+            if index == badness and 0 <= index < len(self.action_table):
+                return self.action_table[index]
+        return self._act(badness)
 
     def useful_counts_remaining(self, y):
         """
@@ -136,13 +375,161 @@ class RLAgent:
 
         """
         badness = self.useful_counts_remaining(y)
-        change = self.agent.act(
-            [float(bool(badness)), float(badness)], independent=True
-        )
-        return (x + change) % self.num_samples
+        return (x + self.change(badness)) % self.num_samples
+
+    def change_batch(self, badness):
+        """
+        Vectorized `change`. With the numpy backend the whole batch goes
+        through one forward pass.
+        """
+        badness = np.asarray(badness, dtype=float)
+        if self.action_table is None:
+            return self._act_batch(badness)
+        index = badness.astype(int)
+        in_table = (index == badness) & (index >= 0) & (index < len(self.action_table))
+        changes = np.empty(badness.shape, dtype=int)
+        changes[in_table] = np.asarray(self.action_table)[index[in_table]]
+        if not in_table.all():
+            changes[~in_table] = self._act_batch(badness[~in_table])
+        return changes
+
+    def act_batch(self, xs, ys):
+        """
+        Recommend the next sample for many racks at once.
+
+        Parameters
+        ----------
+        xs : array of int
+            "Environment" space position of each rack
+        ys : array
+            degree of badness at each position
+
+        Returns
+        -------
+        array of int
+            Next position for each rack
+        """
+        badness = self.useful_counts_remaining(np.asarray(ys))
+        return (np.asarray(xs) + self.change_batch(badness)) % self.num_samples
+
+
+class _TargetPerMotor:
+    """Hand the recommended sample index to each of several motors."""
+
+    def __init__(self, recommender, num_motors):
+        self.recommender = recommender
+        self.num_motors = num_motors
 
+    def tell_many(self, xs, ys):
+        self.recommender.tell_many(xs, ys)
+
+    def ask(self, n, tell_pending=True):
+        points = self.recommender.ask(n, tell_pending=tell_pending)
+        return tuple(indx for indx in points for _ in range(self.num_motors))
+
+
+def _evaluate(key, readings):
+    """Value of a field, or of a callable of fields, in the readings of one shot."""
+    if callable(key):
+        fields = inspect.signature(key).parameters
+        return key(**{name: readings[name]["value"] for name in fields})
+    return readings[key]["value"]
 
-def bad_seed_plan(sample_motor, det, snr, sample_positions, agent, max_shots=50):
+
+def _pipelined_plan(dets, motors, recommender, snr, sample_positions, max_shots):
+    """
+    Take one run per shot, like adaptive_plan, but without waiting on the
+    recommender between shots.
+
+    While the detectors expose on shot j, the recommender is told the reading of
+    shot j - 1 and asked for shot j + 1, with shot j pending. The motors are read
+    back for shot j before the exposure ends and sent on to shot j + 1 as soon
+    as it does, so detector readout overlaps with the move.
+    """
+    motor_names = [motor.name for motor in motors]
+    _md = {
+        "batch_id": str(uuid.uuid4()),
+        "detectors": [det.name for det in dets],
+        "motors": motor_names,
+        "num_points": 1,
+        "plan_name": "bad_seed_plan",
+        "pipelined": True,
+    }
+
+    def move_to(indx, group):
+        for axis, motor in enumerate(motors):
+            position = sample_positions.to_position(indx, axis=axis)
+            yield from bps.abs_set(motor, position, group=group)
+
+    @bpp.stage_decorator(dets)
+    def inner_plan():
+        uids = []
+        next_point = 0
+        last_reading = None
+        move = bps.short_uid("move")
+        yield from move_to(next_point, group=move)
+        recommender.tell_pending([next_point])
+        for j in itertools.count():
+            exposure = bps.short_uid("exposure")
+            yield from bps.wait(group=move)
+            uid = yield from bps.open_run(md={**_md, "batch_count": j})
+            uids.append(uid)
+            for det in dets:
+                yield from bps.trigger(det, group=exposure)
+
+            yield from bps.create("primary")
+            readings = {}
+            for motor in motors:
+                readings.update((yield from bps.read(motor)))
+            # decide where to go next while the exposure runs
+            if last_reading is not None:
+                recommender.tell_many(*last_reading)
+            next_point = None
+            if j < max_shots:
+                try:
+                    (next_point,) = recommender.ask(1)
+                except NoRecommendation:
+                    pass
+            yield from bps.wait(group=exposure)
+
+            move = bps.short_uid("move")
+            if next_point is not None:
+                yield from move_to(next_point, group=move)
+            for det in dets:
+                readings.update((yield from bps.read(det)))
+            yield from bps.save()
+            yield from bps.close_run()
+
+            indx = sample_positions.to_index(
+                [readings[name]["value"] for name in motor_names]
+            )
+            last_reading = ([indx], [(_evaluate(snr, readings),)])
+            if next_point is None:
+                recommender.tell_many(*last_reading)
+                return uids
+
+    return (yield from inner_plan())
+
+
+def _close(recommender):
+    """A plan that shuts down a RemoteRecommender, for use with finalize_wrapper."""
+    recommender.close()
+    yield from []
+
+
+def bad_seed_plan(
+    sample_motor,
+    det,
+    snr,
+    sample_positions,
+    agent,
+    max_shots=50,
+    *,
+    recommender_class=BadSeedRecommender,
+    tolerance=None,
+    pipelined=False,
+    remote=False,
+):
     """
     A plan for using BadSeed to optimize data acquisition at the beamline.
 
@@ -157,8 +544,9 @@ def bad_seed_plan(sample_motor, det, snr, sample_positions, agent, max_shots=50)
 
     Parameters
     ----------
-    sample_motor : OphydObject
-        The device that controls the sample position.
+    sample_motor : OphydObject or List[OphydObject]
+        The device that controls the sample position, or one device per axis
+        (e.g. the x and y stages under a well plate).
 
     det : OphydObject
         The detector to use for data acquisition
@@ -166,8 +554,9 @@ def bad_seed_plan(sample_motor, det, snr, sample_positions, agent, max_shots=50)
     snr : string or callable
         How to compute the signal-to-noise of a single exposure
 
-    sample_positions : Iterable[float]
-        The positions (in lab space) of the samples
+    sample_positions : Iterable[float] or Iterable[Iterable[float]]
+        The positions (in lab space) of the samples, with one coordinate per
+        motor when there are several.
 
     agent : Callable[int, float] -> int
         A callable that given the sample index an the computed SNR, return
@@ -175,25 +564,88 @@ def bad_seed_plan(sample_motor, det, snr, sample_positions, agent, max_shots=50)
 
     max_shots : int, optional
         The maximum number of shots the plan will take (but may exit early).
+
+    recommender_class : type, optional
+        The recommender wrapping the agent, e.g. ArrayBadSeedRecommender for
+        large racks.
+
+    tolerance : float, optional
+        How far (in lab space) a read-back position may be from the nearest
+        sample before the plan fails rather than guessing which one it was.
+
+    pipelined : bool, optional
+        Overlap the recommendation and the next move with the exposure, see
+        `_pipelined_plan`. The recommender then works from readings one shot
+        old. A callable snr gets the plain values of the fields of one reading,
+        rather than the arrays of a run.
+
+    remote : bool, optional
+        Run the recommender and its agent in a worker process, with a local
+        NaiveAgent to fall back on when it is slow to answer, see
+        `remote_recommender.RemoteRecommender`. The worker is shut down when
+        the plan ends.
     """
-    sample_positions = np.array(sample_positions)
+    if remote:
+        from .remote_recommender import RemoteRecommender, agent_factory
+
+        sample_positions = list(sample_positions)
+        recommender = RemoteRecommender(
+            len(sample_positions),
+            agent_factory(agent),
+            recommender_class=recommender_class,
+        )
+        plan = bad_seed_plan(
+            sample_motor,
+            det,
+            snr,
+            sample_positions,
+            agent,
+            max_shots,
+            recommender_class=lambda num_samples, agent: recommender,
+            tolerance=tolerance,
+            pipelined=pipelined,
+        )
+        return (yield from bpp.finalize_wrapper(plan, _close(recommender)))
+
+    if isinstance(sample_motor, (list, tuple)):
+        sample_motors = list(sample_motor)
+    else:
+        sample_motors = [sample_motor]
+    motor_names = [motor.name for motor in sample_motors]
+    sample_positions = SamplePositions(sample_positions, tolerance=tolerance)
 
     # we know that at the reccomender level we do not want to know anything
     # about the real motor positions.  This function converts from lab
     # space to notional "enviroment" space
-    def motor_to_sample_indx(pos):
+    def motor_to_sample_indx(**readings):
         # print("in convert forward")
-        pos = pos.compute().data
-        return np.argmin(np.abs(sample_positions - pos))
+        pos = [readings[name].compute().data for name in motor_names]
+        return sample_positions.to_index(pos)
+
+    # call_or_eval passes the readings of the fields named in the signature
+    motor_to_sample_indx.__signature__ = inspect.Signature(
+        [
+            inspect.Parameter(name, inspect.Parameter.KEYWORD_ONLY)
+            for name in motor_names
+        ]
+    )
 
     # Converesly, at the beamline we have to work in real coordinates, this function
     # converts from the "enviroment" coordinate system to
-    def sample_indx_to_motor(indx):
+    def sample_indx_to_motor(axis):
         # print("in convert back")
-        return sample_positions[int(indx)]
+        return lambda indx: sample_positions.to_position(indx, axis=axis)
 
     # create the recomender to wrap the agent.
-    recommender = BadSeedRecommender(num_samples=len(sample_positions), agent=agent)
+    recommender = recommender_class(num_samples=len(sample_positions), agent=agent)
+    if pipelined:
+        return (
+            yield from _pipelined_plan(
+                [det], sample_motors, recommender, snr, sample_positions, max_shots
+            )
+        )
+    if len(sample_motors) > 1:
+        recommender = _TargetPerMotor(recommender, len(sample_motors))
     # set up the machinery to:
     #  - unpack and reduce the raw data
     #  - pass the reduced data into the recommendation engine (tell)
@@ -206,10 +658,12 @@ def bad_seed_plan(sample_motor, det, snr, sample_positions, agent, max_shots=50)
     #   queue : where the plan should query to get the next step
     cb, queue = recommender_factory(
         adaptive_obj=recommender,
-        independent_keys=[lambda sample_selector: motor_to_sample_indx(sample_selector)],
+        independent_keys=[motor_to_sample_indx],
         dependent_keys=[snr],
-        target_keys=[sample_motor.name],
-        target_transforms={sample_motor.name: sample_indx_to_motor},
+        target_keys=motor_names,
+        target_transforms={
+            name: sample_indx_to_motor(axis) for axis, name in enumerate(motor_names)
+        },
         max_count=max_shots,
     )
 
@@ -223,14 +677,17 @@ def bad_seed_plan(sample_motor, det, snr, sample_positions, agent, max_shots=50)
     #  This takes care of running data collection, moving as instructed by the
     #  recommendation.
     yield from adaptive_plan(
-        dets=[detector],
-        first_point={sample_motor: 0},
+        dets=[det],
+        first_point={
+            motor: sample_positions.to_position(0, axis=axis)
+            for axis, motor in enumerate(sample_motors)
+        },
         to_recommender=cb,
         from_recommender=queue,
     )
 
 
-def with_agent(agent, max_shots):
+def with_agent(agent, max_shots, *, pipelined=False, remote=False):
     """
     A plan for using BadSeed to optimize data acquisition at the beamline.
 
@@ -255,6 +712,12 @@ def with_agent(agent, max_shots):
     max_shots : int, optional
         The maximum number of shots the plan will take (but may exit early).
 
+    pipelined : bool, optional
+        Decide and move to the next sample while the current one is exposing.
+
+    remote : bool, optional
+        Run the agent in a worker process, see `bad_seed_plan`.
+
     """
     return (
         yield from bad_seed_plan(
@@ -264,5 +727,7 @@ def with_agent(agent, max_shots):
             sample_positions=list(range(9)),
             agent=agent,
             max_shots=max_shots,
+            pipelined=pipelined,
+            remote=remote,
         )
-    )
\ No newline at end of file
+    )
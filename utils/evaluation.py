@@ -0,0 +1,234 @@
+"""
+Offline evaluation of agents on the CartSeed game.
+
+Agents are scored on many simulated racks at once instead of running the
+adaptive plan in real time. Episodes are split into fixed-size chunks, each with
+its own child of the seed, and the chunks are farmed out to a process pool, so the
+results do not depend on the number of workers. Every agent plays the same racks.
+Checkpoints run on the exported NumPy policy with a precomputed action table,
+unless ``--backend tensorflow`` is given.
+
+    python -m utils.evaluation --episodes 5000 \
+        --checkpoint tf_models/bluesky-tutorial/saved_models
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from .vector_env import VectorCartSeed, VectorCartSeedCountdown
+
+ENVIRONMENTS = {1: VectorCartSeed, 2: VectorCartSeedCountdown}
+
+
+def run_episodes(
+    agent_factory,
+    num_episodes,
+    *,
+    env_version=1,
+    seed_count=9,
+    max_count=10,
+    time_limit=None,
+    seed=None,
+):
+    """
+    Play episodes in lockstep with a single agent.
+
+    The agent is used like in BadSeedRecommender: given the current sample index and
+    the number of useful shots left on it, it returns the sample to measure next.
+    Any answer other than the current index is a move to the next sample. Agents
+    with an ``act_batch`` method are asked about every episode at once.
+
+    Parameters
+    ----------
+    agent_factory : Callable[int] -> Callable[int, int] -> int
+        Called with the number of samples to build the agent, e.g. NaiveAgent
+    num_episodes : int
+        Number of episodes to play
+    env_version : int in {1, 2}
+        Environment version. 1 being CartSeed, 2 being CartSeedCountdown
+    seed_count : int
+        Number of samples in the rack
+    max_count : int
+        Maximum number of shots needed to saturate a bad seed
+    time_limit : int, None
+        Shots per episode. If None, the number an optimal agent needs.
+    seed : int, np.random.SeedSequence, None
+        Seed for the racks
+
+    Returns
+    -------
+    results : dict
+        Arrays of shape (num_episodes,) for
+            - "score": total reward, 100 being a perfect episode
+            - "shots_to_completion": shots until every bad seed was saturated,
+              NaN if that did not happen in time
+            - "wasted_shots": shots on good or already saturated seeds
+    """
+    env = ENVIRONMENTS[env_version](
+        num_episodes,
+        seed_count,
+        max_count=max_count,
+        sequential=True,
+        revisiting=True,
+        measurement_time=time_limit,
+        seed=seed,
+    )
+    agent = agent_factory(seed_count)
+    all_envs = np.arange(num_episodes)
+
+    states = env.reset()
+    score = np.zeros(num_episodes)
+    wasted_shots = np.zeros(num_episodes, dtype=int)
+    shots_to_completion = np.full(num_episodes, np.nan)
+    shots_to_completion[env.bad_seed_count == 0] = 0
+    active = np.ones(num_episodes, dtype=bool)
+    actions = np.zeros(num_episodes, dtype=int)
+
+    while active.any():
+        xs = env.current_idx
+        ys = states[:, -1].clip(min=0).astype(int)
+        if hasattr(agent, "act_batch"):
+            actions[:] = agent.act_batch(xs, ys) != xs
+        else:
+            for n in np.flatnonzero(active):
+                actions[n] = agent(int(xs[n]), int(ys[n])) != xs[n]
+        states, terminals, rewards = env.execute(actions)
+
+        # After the shot, a useful one leaves a bad seed's countdown at 0 or above.
+        shot = env.seeds[all_envs, env.current_idx]
+        useful = (shot[:, 0] != 0) & (shot[:, 1] >= 0)
+        remaining = ((env.seeds[..., 0] != 0) * env.seeds[..., 1].clip(min=0)).sum(1)
+
+        score[active] += rewards[active]
+        wasted_shots[active & ~useful] += 1
+        completed = active & (remaining == 0) & np.isnan(shots_to_completion)
+        shots_to_completion[completed] = env.timestep[completed]
+        active &= ~terminals
+
+    return dict(
+        score=score, shots_to_completion=shots_to_completion, wasted_shots=wasted_shots
+    )
+
+
+def evaluate_agents(
+    agents, num_episodes=1000, *, chunk_size=250, max_workers=None, seed=0, **kwargs
+):
+    """
+    Evaluate several agents on the same racks across a process pool.
+
+    Parameters
+    ----------
+    agents : dict
+        Maps a name to a picklable agent factory, e.g. ``NaiveAgent`` or
+        ``functools.partial(RLAgent, path=...)``.
+    num_episodes : int
+        Episodes per agent
+    chunk_size : int
+        Episodes per task handed to a worker
+    max_workers : int, None
+        Size of the process pool. None uses the number of CPUs.
+    seed : int
+        Root seed. Chunk i always gets the i-th child of it.
+    **kwargs
+        Environment parameters passed on to `run_episodes`
+
+    Returns
+    -------
+    results : dict
+        Maps each name to the concatenated `run_episodes` results
+    """
+    chunk_sizes = [
+        min(chunk_size, num_episodes - start)
+        for start in range(0, num_episodes, chunk_size)
+    ]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            name: [
+                pool.submit(run_episodes, factory, size, seed=chunk_seed, **kwargs)
+                for size, chunk_seed in zip(chunk_sizes, seeds)
+            ]
+            for name, factory in agents.items()
+        }
+        chunks = {name: [f.result() for f in fs] for name, fs in futures.items()}
+    return {
+        name: {key: np.concatenate([c[key] for c in results]) for key in results[0]}
+        for name, results in chunks.items()
+    }
+
+
+def summarize(results):
+    """
+    Reduce `evaluate_agents` results to summary statistics per agent and metric.
+    """
+    summary = {}
+    for name, metrics in results.items():
+        summary[name] = {}
+        for key, values in metrics.items():
+            finite = values[~np.isnan(values)]
+            if not len(finite):
+                finite = np.array([np.nan])
+            summary[name][key] = dict(
+                mean=finite.mean(),
+                std=finite.std(),
+                median=np.median(finite),
+                completed=np.mean(~np.isnan(values)),
+            )
+    return summary
+
+
+def main(argv=None):
+    from .adaptive_recommendations import CheatingAgent, NaiveAgent, RLAgent
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--episodes", type=int, default=1000)
+    parser.add_argument("--env-version", type=int, default=1, choices=(1, 2))
+    parser.add_argument("--seed-count", type=int, default=9)
+    parser.add_argument("--max-count", type=int, default=10)
+    parser.add_argument("--time-limit", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--checkpoint",
+        action="append",
+        default=[],
+        help="RLAgent checkpoint directory to evaluate (may be repeated)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=("numpy", "tensorflow"),
+        default="numpy",
+        help="RLAgent backend. tensorflow loads the full tensorforce agent in "
+        "every worker, which is much slower.",
+    )
+    args = parser.parse_args(argv)
+
+    agents = {"naive": NaiveAgent, "cheating": CheatingAgent}
+    for path in args.checkpoint:
+        agents[path] = partial(
+            RLAgent, path=path, backend=args.backend, max_count=args.max_count
+        )
+    results = evaluate_agents(
+        agents,
+        args.episodes,
+        max_workers=args.workers,
+        seed=args.seed,
+        env_version=args.env_version,
+        seed_count=args.seed_count,
+        max_count=args.max_count,
+        time_limit=args.time_limit,
+    )
+    for name, metrics in summarize(results).items():
+        print(name)
+        for key, stats in metrics.items():
+            print(
+                f"  {key:>20}: mean {stats['mean']:8.2f}  std {stats['std']:8.2f}  "
+                f"median {stats['median']:8.2f}  completed {stats['completed']:.0%}"
+            )
+
+
+if __name__ == "__main__":
+    main()
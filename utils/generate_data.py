@@ -1,26 +1,65 @@
-import random
+import functools
+from pathlib import Path
+
 import numpy as np
 
 
 def make_random_peaks(
-    x, xmin=None, xmax=None, peak_chance=0.1, return_pristine_peaks=False
+    x, xmin=None, xmax=None, peak_chance=0.1, return_pristine_peaks=False, rng=None
 ):
+    (y,) = make_random_peaks_batch(
+        x, 1, xmin=xmin, xmax=xmax, peak_chance=peak_chance, rng=rng
+    )
+    return y
+
+
+def make_random_peaks_batch(
+    x, n_samples, xmin=None, xmax=None, peak_chance=0.1, rng=None
+):
+    """
+    Generate the 1D patterns of a whole batch of samples at once.
 
+    Equivalent to calling `make_random_peaks` ``n_samples`` times, but the
+    per-peak loop is replaced by a single (n_samples, len(x)) x (len(x), len(x))
+    matrix product against a table of every possible peak.
+
+    Parameters
+    ----------
+    rng : np.random.Generator, optional
+        If None, the global np.random state is used.
+
+    Returns
+    -------
+    y : array
+        Intensities with shape (n_samples, len(x))
+    """
+    random_source = np.random if rng is None else rng
+    draws = random_source.random((n_samples, len(x)))
+    return _peaks_from_draws(x, draws, xmin, xmax, peak_chance)
+
+
+def _peaks_from_draws(x, draws, xmin, xmax, peak_chance):
     # select boundaries for peaks
     if xmin is None:
         xmin = np.percentile(x, 10)
     if xmax is None:
         xmax = np.percentile(x, 90)
 
-    y = np.zeros(len(x))
-
     # make peak positions
-    peak_pos = np.array(np.random.random(len(x)) < peak_chance)
-    peak_pos[x < xmin] = False
-    peak_pos[x > xmax] = False
+    peak_pos = draws < peak_chance
+    allowed = (x >= xmin) & (x <= xmax)
+    peak_pos[:, ~allowed] = False
 
-    for peak_idex in [i for i, x in enumerate(peak_pos) if x]:
-        y += gaussian(x, c=x[peak_idex], sig=0.1, amp=(1 / x[peak_idex]) ** 0.5)
+    # row i is the peak centered at x[i]; rows that can never be picked stay 0
+    centers = x[allowed]
+    kernel = np.zeros((len(x), len(x)))
+    kernel[allowed] = gaussian(
+        x[np.newaxis, :],
+        c=centers[:, np.newaxis],
+        sig=0.1,
+        amp=(1 / centers[:, np.newaxis]) ** 0.5,
+    )
+    y = peak_pos.astype(float) @ kernel
 
     # now for any diffuse low-Q component
     y += gaussian(x, c=0, sig=3, amp=0.1)
@@ -46,51 +85,499 @@ def gaussian(x, c=0, sig=1, amp=None):
 #     return np.broadcast_to(np.repeat(values, 20)[: shape[0]], shape).copy()
 
 
+class RadialGeometry:
+    """
+    Precomputed mapping from a 1D q grid onto the pixels of a 2D detector.
+
+    Holds the radius of every pixel (in units of ``x``) together with the
+    index of the grid point just below it and the linear interpolation weight
+    towards the next one, so rendering an image is one gather plus a weighted
+    add.
+
+    Prefer `radial_geometry`, which caches instances per (shape, x) pair.
+    """
+
+    def __init__(self, x, shape):
+        """
+
+        Parameters
+        ----------
+        x : array
+            Monotonically increasing 1D grid the intensities are sampled on
+        shape : tuple
+            Shape of the 2D detector image. Odd lengths are rounded down to
+            even ones, which is the shape images are rendered with.
+        """
+        self.x = np.array(x, dtype=float)
+
+        xL, yL = shape[0] // 2, shape[1] // 2  # half-lengths
+        self.shape = (2 * xL, 2 * yL)
+        x_, y_ = np.mgrid[-xL:xL, -yL:yL]
+        ordinal_r = np.hypot(x_, y_)
+        unit_r = ordinal_r / ordinal_r.max()
+        self.radius = unit_r * self.x.max()
+
+        # Same result as np.interp(radius, x, intensity).
+        index = np.searchsorted(self.x, self.radius, side="right") - 1
+        self.index = np.clip(index, 0, len(self.x) - 2)
+        self.weight = np.clip(
+            (self.radius - self.x[self.index])
+            / (self.x[self.index + 1] - self.x[self.index]),
+            0,
+            1,
+        )
+        # Total weight each grid point receives, for averaging in `integrate`.
+        self.norm = self._scatter(np.ones(self.shape))[0]
+        for arr in (self.x, self.radius, self.index, self.weight, self.norm):
+            arr.flags.writeable = False
+
+    def render(self, intensities):
+        """
+        Turn 1D intensities into 2D images.
+
+        Parameters
+        ----------
+        intensities : array
+            Shape (len(x),) or (n_samples, len(x))
+
+        Returns
+        -------
+        image : array
+            Shape ``shape`` or (n_samples, *shape)
+        """
+        intensities = np.asarray(intensities, dtype=float)
+        lower = intensities[..., :-1]
+        step = np.diff(intensities, axis=-1)
+        return lower[..., self.index] + step[..., self.index] * self.weight
+
+    def _scatter(self, values):
+        """
+        Spread pixel values onto the grid with the interpolation weights.
+
+        Returns the per grid point sums, shape (n_images, len(x)).
+        """
+        n = len(self.x)
+        values = values.reshape(-1, self.index.size)
+        # one set of bins per image, so a batch is a single bincount
+        offsets = n * np.arange(len(values))[:, np.newaxis]
+        lower = (self.index.ravel() + offsets).ravel()
+        weight = self.weight.ravel()
+        size = n * len(values)
+        sums = np.bincount(lower, (values * (1 - weight)).ravel(), minlength=size)
+        sums += np.bincount(lower + 1, (values * weight).ravel(), minlength=size)
+        return sums.reshape(len(values), n)
+
+    def integrate(self, images):
+        """
+        Average 2D images azimuthally back onto the 1D grid.
+
+        The transpose of `render`: every pixel is split between the two grid
+        points around its radius with the same weights, and each grid point is
+        the weighted mean of its pixels. Grid points no pixel is near are 0.
+
+        Parameters
+        ----------
+        images : array
+            Shape ``shape`` or (n_images, *shape)
+
+        Returns
+        -------
+        profile : array
+            Shape (len(x),) or (n_images, len(x))
+        """
+        images = np.asarray(images)
+        sums = self._scatter(images).reshape(*images.shape[:-2], len(self.x))
+        return np.divide(sums, self.norm, out=np.zeros(sums.shape), where=self.norm > 0)
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_radial_geometry(shape, x_bytes):
+    return RadialGeometry(np.frombuffer(x_bytes), shape)
+
+
+def radial_geometry(x, shape):
+    """
+    Return the (cached) RadialGeometry for this q grid and detector shape.
+    """
+    x = np.ascontiguousarray(x, dtype=float)
+    return _cached_radial_geometry(tuple(shape), x.tobytes())
+
+
 def generate_ideal_image(x, intensity, shape):
     """
     Given a 1D array of intensity, generate a 2D diffraction image.
     """
-    xL, yL = shape[0] // 2, shape[1] // 2  # half-lengths of each dimension
-    x_, y_ = np.mgrid[-xL:xL, -yL:yL]
-    ordinal_r = np.hypot(x_, y_)
-    unit_r = ordinal_r / ordinal_r.max()
-    r = unit_r * x.max()
-    return np.interp(r, x, intensity)
+    return radial_geometry(x, shape).render(intensity)
+
+
+def generate_ideal_images(x, intensities, shape):
+    """
+    Given a (n_samples, len(x)) array of intensity, generate a stack of 2D
+    diffraction images with shape (n_samples, *shape).
+    """
+    return radial_geometry(x, shape).render(intensities)
+
+
+class NoiseGenerator:
+    """
+    Uniform detector noise drawn from a dedicated np.random.Generator.
+
+    Frames are filled in place, either into a caller-supplied ``out`` array or,
+    if ``pool_size`` is given, into a rotating pool of preallocated buffers.
+    A pooled frame is only valid until ``pool_size`` further frames have been
+    drawn, so copy it if it needs to outlive that.
+    """
 
+    def __init__(self, shape, *, seed=None, dtype=np.float64, pool_size=0):
+        """
 
-def generate_noise_image(shape, noise_level):
-    return np.random.random(shape) * noise_level
+        Parameters
+        ----------
+        shape : tuple
+            Shape of the noise frames
+        seed : int, np.random.SeedSequence, np.random.Generator, None
+            Anything np.random.default_rng accepts
+        dtype : {np.float64, np.float32}
+            Precision of the frames. float32 halves the memory traffic.
+        pool_size : int
+            Number of reusable buffers to rotate through when ``out`` is not
+            given. If 0, a new array is allocated for every frame.
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.float64):
+            raise ValueError("dtype must be float32 or float64")
+        self.rng = np.random.default_rng(seed)
+        self._pool = [np.empty(self.shape, self.dtype) for _ in range(pool_size)]
+        self._next_buffer = 0
 
+    def _buffer(self):
+        if not self._pool:
+            return np.empty(self.shape, self.dtype)
+        buffer = self._pool[self._next_buffer]
+        self._next_buffer = (self._next_buffer + 1) % len(self._pool)
+        return buffer
 
-# At global scope, define 9 samples that we will base this demo/tutorial on.
+    def noise(self, noise_level, out=None):
+        """
+        Fill a frame with noise uniformly distributed in [0, noise_level).
+        """
+        if out is None:
+            out = self._buffer()
+        self.rng.random(out=out, dtype=out.dtype)
+        out *= noise_level
+        return out
+
+    def measure(self, ideal_pattern, noise_level, out=None):
+        """
+        Fill a frame with ``ideal_pattern`` plus noise, without temporaries.
+        """
+        out = self.noise(noise_level, out=out)
+        out += ideal_pattern
+        return out
+
+
+def generate_noise_image(shape, noise_level, *, out=None, rng=None):
+    """
+    Generate a frame of uniform noise in [0, noise_level).
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the frame
+    noise_level : float
+        Upper bound of the noise
+    out : array, optional
+        float32 or float64 array to fill in place
+    rng : np.random.Generator, optional
+        If None, the global np.random state is used.
+    """
+    if out is None:
+        out = np.empty(shape)
+    if rng is None:
+        out[...] = np.random.random(shape)
+    else:
+        rng.random(out=out, dtype=out.dtype)
+    out *= noise_level
+    return out
+
+
+# Defaults for the 9 samples that this demo/tutorial is based on.
 
 SHAPE = (128, 128)
 x = np.linspace(0, 30, num=101)
 
 num_samples = 9
 
-intensities = []
-ideal_patterns = []
-# Decide that 3-6 of these samples are "good".
-# The first one (0) is always good and the second one (1) is always bad.
-# Some random number of additional ones, up to a total of 6, are also good.
-good_seeds = [0] + np.random.choice(np.arange(2, 9), size=random.randint(2, 5), replace=False).tolist()
 
-for _ in range(num_samples):
-    iq = make_random_peaks(x, peak_chance=0.2) * 1000.0
-    image = generate_ideal_image(x, iq, SHAPE)
-    intensities.append(iq)
-    ideal_patterns.append(image)
+class _SampleLibraryBase:
+    """
+    Behaviour shared by every sample library.
 
+    Subclasses set ``num_samples``, ``shape``, ``x``, ``good_seeds`` and
+    ``_is_good`` and implement ``intensity`` and ``ideal_pattern``.
+    """
 
-def generate_measured_image(sample_number):
-    ideal_pattern = ideal_patterns[sample_number]
-    if sample_number in good_seeds:
-        noise_level = 100  # low noise
-    else:
-        noise_level = 800  # high noise
+    def __len__(self):
+        return self.num_samples
 
-    return (
-        ideal_pattern + generate_noise_image(ideal_pattern.shape, noise_level),
-        noise_level,
-    )
+    def _check_index(self, sample_number):
+        sample_number = int(sample_number)
+        if not 0 <= sample_number < self.num_samples:
+            raise IndexError(
+                f"sample {sample_number} is outside a rack of {self.num_samples}"
+            )
+        return sample_number
+
+    def is_good(self, sample_number):
+        return bool(self._is_good[self._check_index(sample_number)])
+
+    def noise_level(self, sample_number):
+        if self.is_good(sample_number):
+            return 100  # low noise
+        else:
+            return 800  # high noise
+
+    def generate_measured_image(self, sample_number, *, out=None, noise=None):
+        """See the module-level `generate_measured_image`."""
+        ideal_pattern = self.ideal_pattern(sample_number)
+        noise_level = self.noise_level(sample_number)
+        if noise is None:
+            image = generate_noise_image(ideal_pattern.shape, noise_level, out=out)
+            image += ideal_pattern
+        else:
+            image = noise.measure(ideal_pattern, noise_level, out=out)
+        return image, noise_level
+
+
+class SampleLibrary(_SampleLibraryBase):
+    """
+    A rack of simulated samples whose patterns are generated on demand.
+
+    Each sample draws its peaks from its own child of ``seed``, so a given
+    sample has the same pattern no matter which samples are accessed first
+    (or at all). Patterns are memoized on first access.
+    """
+
+    def __init__(
+        self,
+        num_samples=num_samples,
+        shape=SHAPE,
+        x=x,
+        *,
+        seed=None,
+        peak_chance=0.2,
+    ):
+        """
+
+        Parameters
+        ----------
+        num_samples : int
+            Number of samples in the rack
+        shape : tuple
+            Detector image shape
+        x : array
+            q grid of the 1D patterns
+        seed : int, np.random.SeedSequence, None
+            Seed for the whole rack. If None, fresh entropy is used.
+        peak_chance : float
+            Chance that any grid point in the peak window carries a peak
+        """
+        self.num_samples = int(num_samples)
+        self.shape = tuple(shape)
+        self.x = np.asarray(x, dtype=float)
+        self.peak_chance = peak_chance
+        if isinstance(seed, np.random.SeedSequence):
+            self.seed_sequence = seed
+        else:
+            self.seed_sequence = np.random.SeedSequence(seed)
+
+        # Decide that roughly 2/7 to 5/7 of the samples are "good".
+        # The first one (0) is always good and the second one (1) is always bad.
+        # Some random number of additional ones are also good.
+        rng = np.random.default_rng(self.seed_sequence)
+        candidates = np.arange(2, self.num_samples)
+        num_extra = rng.integers(2 * len(candidates) // 7, 5 * len(candidates) // 7 + 1)
+        extra = rng.choice(candidates, size=num_extra, replace=False)
+        self.good_seeds = [0] + sorted(extra.tolist())
+        self._is_good = np.zeros(self.num_samples, dtype=bool)
+        self._is_good[self.good_seeds] = True
+
+        self._intensities = {}
+        self._ideal_patterns = {}
+
+    def _rng(self, sample_number):
+        child = np.random.SeedSequence(
+            self.seed_sequence.entropy,
+            spawn_key=self.seed_sequence.spawn_key + (sample_number,),
+        )
+        return np.random.default_rng(child)
+
+    def intensity(self, sample_number):
+        """The 1D I(q) of a sample."""
+        sample_number = self._check_index(sample_number)
+        try:
+            return self._intensities[sample_number]
+        except KeyError:
+            pass
+        (iq,) = self._generate_intensities([sample_number])
+        self._intensities[sample_number] = iq
+        return iq
+
+    def _generate_intensities(self, sample_numbers):
+        draws = np.stack([self._rng(i).random(len(self.x)) for i in sample_numbers])
+        return _peaks_from_draws(self.x, draws, None, None, self.peak_chance) * 1000.0
+
+    def ideal_pattern(self, sample_number):
+        """The noise-free 2D image of a sample."""
+        sample_number = self._check_index(sample_number)
+        try:
+            return self._ideal_patterns[sample_number]
+        except KeyError:
+            pass
+        image = generate_ideal_image(self.x, self.intensity(sample_number), self.shape)
+        self._ideal_patterns[sample_number] = image
+        return image
+
+    def save(self, path, *, dtype=np.float32, chunk_size=64):
+        """
+        Write the whole rack to a directory readable by `StoredSampleLibrary`.
+
+        Patterns are generated ``chunk_size`` samples at a time straight into
+        a memory-mapped .npy file, so the rack never has to fit in memory.
+
+        Parameters
+        ----------
+        path : Path, str
+            Directory to create (or overwrite the library in)
+        dtype : np.dtype
+            Precision of the stored image stack
+        chunk_size : int
+            Number of samples rendered per batch
+
+        Returns
+        -------
+        StoredSampleLibrary
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        geometry = radial_geometry(self.x, self.shape)
+        patterns = np.lib.format.open_memmap(
+            path / StoredSampleLibrary.patterns_file,
+            mode="w+",
+            dtype=dtype,
+            shape=(self.num_samples, *geometry.shape),
+        )
+        intensities = np.empty((self.num_samples, len(self.x)))
+        for start in range(0, self.num_samples, chunk_size):
+            stop = min(start + chunk_size, self.num_samples)
+            intensities[start:stop] = self._generate_intensities(range(start, stop))
+            patterns[start:stop] = geometry.render(intensities[start:stop])
+        patterns.flush()
+        del patterns
+        np.savez(
+            path / StoredSampleLibrary.metadata_file,
+            x=self.x,
+            intensities=intensities,
+            good=self._is_good,
+        )
+        return StoredSampleLibrary(path)
+
+
+class StoredSampleLibrary(_SampleLibraryBase):
+    """
+    A rack of samples read from disk, as written by `SampleLibrary.save`.
+
+    The directory holds the image stack as a .npy file, which is memory-mapped
+    read-only so patterns are served zero-copy and only touched pages become
+    resident, and a metadata sidecar with the q grid, the 1D intensities and
+    the good/bad labels.
+    """
+
+    patterns_file = "ideal_patterns.npy"
+    metadata_file = "metadata.npz"
+
+    def __init__(self, path):
+        """
+
+        Parameters
+        ----------
+        path : Path, str
+            Directory written by `SampleLibrary.save`
+        """
+        self.path = Path(path)
+        self.ideal_patterns = np.load(self.path / self.patterns_file, mmap_mode="r")
+        with np.load(self.path / self.metadata_file) as metadata:
+            self.x = metadata["x"]
+            self.intensities = metadata["intensities"]
+            self._is_good = metadata["good"]
+        self.num_samples, *shape = self.ideal_patterns.shape
+        self.shape = tuple(shape)
+        self.good_seeds = np.flatnonzero(self._is_good).tolist()
+
+    def intensity(self, sample_number):
+        """The 1D I(q) of a sample."""
+        return self.intensities[self._check_index(sample_number)]
+
+    def ideal_pattern(self, sample_number):
+        """The noise-free 2D image of a sample, as a view into the memmap."""
+        return self.ideal_patterns[self._check_index(sample_number)]
+
+
+_sample_library = None
+
+
+def get_sample_library():
+    """
+    Return the library used by the simulated hardware, creating the default
+    (unseeded, 9 samples of SHAPE) on first use.
+    """
+    global _sample_library
+    if _sample_library is None:
+        _sample_library = SampleLibrary()
+    return _sample_library
+
+
+def set_sample_library(library):
+    """Swap in a different SampleLibrary for the simulated hardware."""
+    global _sample_library
+    _sample_library = library
+
+
+def __getattr__(name):
+    # Module-level views of the default library, kept for backward compatibility.
+    if name == "good_seeds":
+        return get_sample_library().good_seeds
+    if name == "intensities":
+        library = get_sample_library()
+        return [library.intensity(i) for i in range(len(library))]
+    if name == "ideal_patterns":
+        library = get_sample_library()
+        return [library.ideal_pattern(i) for i in range(len(library))]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def generate_measured_image(sample_number, *, out=None, noise=None, library=None):
+    """
+    Simulate one exposure of a sample.
+
+    Parameters
+    ----------
+    sample_number : int
+        Which sample is in the beam
+    out : array, optional
+        Array to write the image into, avoiding a new allocation
+    noise : NoiseGenerator, optional
+        Where to draw the noise from. If None, the global np.random state is
+        used.
+    library : SampleLibrary, optional
+        Rack the sample comes from. Defaults to `get_sample_library()`.
+
+    Returns
+    -------
+    image : array
+    noise_level : int
+    """
+    if library is None:
+        library = get_sample_library()
+    return library.generate_measured_image(sample_number, out=out, noise=noise)
@@ -0,0 +1,180 @@
+"""
+Process-wide cache of loaded agents.
+
+Restoring a checkpoint with `tf_agent.load_agent` imports TensorFlow, builds a
+CartSeed environment and an A2C graph, which takes seconds. The registry does that
+at most once per (checkpoint, backend, parameters), optionally in a background
+thread ahead of time, and hands the same loaded agent to everyone who asks.
+
+    from utils.model_registry import registry
+
+    registry.preload("bluesky-tutorial", "bluesky-tutorial-time50")  # returns at once
+    ...
+    agent = registry.get("bluesky-tutorial")  # waits only if still loading
+
+`warm` does the preload for the shipped checkpoints, for calling at startup.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import threading
+
+MODELS_DIR = Path(__file__).resolve().parent.parent / "tf_models"
+
+# Checkpoints shipped with the tutorial and the load_agent parameters they need.
+CHECKPOINTS = {
+    "bluesky-tutorial": (MODELS_DIR / "bluesky-tutorial" / "saved_models", {}),
+    "bluesky-tutorial-time50": (
+        MODELS_DIR / "bluesky-tutorial-time50" / "saved_models",
+        {"time_limit": 50},
+    ),
+}
+
+
+def _load(path, backend, params):
+    if backend == "tensorflow":
+        import tensorflow as tf
+        from .tf_agent import load_agent
+
+        tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
+        return load_agent(path, **params)
+    elif backend == "numpy":
+        from .numpy_policy import NumpyPolicy
+
+        return NumpyPolicy(path)
+    else:
+        raise ValueError(f"Unknown backend {backend!r}")
+
+
+class ModelRegistry:
+    """
+    Loaded agents keyed by checkpoint path, backend and load_agent parameters.
+
+    Loads run one at a time on a single background thread, as graph construction
+    is not meant to be done concurrently.
+    """
+
+    def __init__(self, checkpoints=None):
+        """
+
+        Parameters
+        ----------
+        checkpoints : dict, None
+            Maps names to (path, load_agent parameters). Defaults to CHECKPOINTS.
+        """
+        self.checkpoints = dict(CHECKPOINTS if checkpoints is None else checkpoints)
+        self._models = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="model-registry"
+        )
+        self._active = None
+
+    def _key(self, checkpoint, backend, params):
+        if str(checkpoint) in self.checkpoints:
+            path, defaults = self.checkpoints[str(checkpoint)]
+            params = {**defaults, **params}
+        else:
+            path = checkpoint
+        path = str(Path(path).resolve())
+        return (path, backend, tuple(sorted(params.items())))
+
+    def _future(self, key):
+        with self._lock:
+            future = self._models.get(key)
+            if future is None:
+                path, backend, params = key
+                future = self._executor.submit(_load, path, backend, dict(params))
+                self._models[key] = future
+            return future
+
+    def preload(self, *checkpoints, backend="tensorflow", **params):
+        """
+        Start loading checkpoints in the background and return immediately.
+
+        Parameters
+        ----------
+        *checkpoints : str, Path
+            Names from ``checkpoints`` or paths to checkpoint directories
+        backend : {"tensorflow", "numpy"}
+            See RLAgent
+        **params
+            Passed on to load_agent, on top of any registered defaults
+
+        Returns
+        -------
+        list of concurrent.futures.Future
+        """
+        return [
+            self._future(self._key(checkpoint, backend, params))
+            for checkpoint in checkpoints
+        ]
+
+    def get(self, checkpoint, *, backend="tensorflow", timeout=None, **params):
+        """
+        Return the loaded agent, loading it (or waiting for the preload) if needed.
+
+        A failed load is forgotten so that the next call tries again.
+        """
+        key = self._key(checkpoint, backend, params)
+        future = self._future(key)
+        try:
+            return future.result(timeout=timeout)
+        except Exception:
+            if future.done():
+                with self._lock:
+                    if self._models.get(key) is future:
+                        del self._models[key]
+            raise
+
+    def is_loaded(self, checkpoint, *, backend="tensorflow", **params):
+        """Whether the agent is ready to be handed out without waiting."""
+        future = self._models.get(self._key(checkpoint, backend, params))
+        return future is not None and future.done() and future.exception() is None
+
+    def activate(self, checkpoint, *, backend="tensorflow", **params):
+        """
+        Make a checkpoint the active one, for use via `active`.
+
+        Swapping back and forth between checkpoints does not reload them.
+        Returns the future of the load.
+        """
+        (future,) = self.preload(checkpoint, backend=backend, **params)
+        self._active = (checkpoint, backend, params)
+        return future
+
+    def active(self, timeout=None):
+        """Return the agent of the active checkpoint."""
+        if self._active is None:
+            raise RuntimeError("No checkpoint has been activated")
+        checkpoint, backend, params = self._active
+        return self.get(checkpoint, backend=backend, timeout=timeout, **params)
+
+    def evict(self, checkpoint, *, backend="tensorflow", **params):
+        """Drop a loaded agent so it can be garbage collected."""
+        with self._lock:
+            self._models.pop(self._key(checkpoint, backend, params), None)
+
+
+registry = ModelRegistry()
+
+
+def warm(*checkpoints, backend="tensorflow"):
+    """
+    Start loading checkpoints in the background of the shared registry.
+
+    Call it at startup, e.g. near the top of a notebook, so the first RLAgent
+    does not wait for TensorFlow.
+
+    Parameters
+    ----------
+    *checkpoints : str, Path
+        Defaults to every checkpoint in CHECKPOINTS
+    backend : {"tensorflow", "numpy"}
+        See RLAgent
+
+    Returns
+    -------
+    list of concurrent.futures.Future
+    """
+    return registry.preload(*(checkpoints or CHECKPOINTS), backend=backend)
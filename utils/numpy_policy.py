@@ -0,0 +1,153 @@
+"""
+TensorFlow-free inference for the pretrained BadSeed policies.
+
+The A2C agents in tf_models/ use tensorforce's default "auto" policy network: two
+tanh dense layers followed by a linear layer giving one value per action. Those
+weights are read out of the checkpoint once with `export_policy` (which needs
+TensorFlow, but not tensorforce) and saved next to it as a small .npz. After that,
+`NumpyPolicy` runs the forward pass with nothing but NumPy.
+
+    python -m utils.numpy_policy tf_models/bluesky-tutorial/saved_models
+"""
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+POLICY_FILE = "policy.npz"
+
+
+def export_policy(path, output=None, *, scope="agent/policy"):
+    """
+    Extract the policy weights from a tensorforce checkpoint into an .npz file.
+
+    Parameters
+    ----------
+    path : Path, str
+        Checkpoint directory, e.g. tf_models/bluesky-tutorial/saved_models
+    output : Path, str, None
+        Where to write. Defaults to policy.npz inside ``path``.
+    scope : str
+        Variable scope of the policy in the checkpoint
+
+    Returns
+    -------
+    Path of the written file
+    """
+    import tensorflow as tf
+
+    path = Path(path)
+    if output is None:
+        output = path / POLICY_FILE
+    reader = tf.train.load_checkpoint(tf.train.latest_checkpoint(str(path)))
+    variables = reader.get_variable_to_shape_map()
+
+    arrays = dict(activation=np.array("tanh"))
+    depth = 0
+    while f"{scope}/policy-network/state-dense{depth}/weights" in variables:
+        layer = f"{scope}/policy-network/state-dense{depth}"
+        arrays[f"layer{depth}_weights"] = reader.get_tensor(f"{layer}/weights")
+        arrays[f"layer{depth}_bias"] = reader.get_tensor(f"{layer}/bias")
+        depth += 1
+    if depth == 0:
+        raise ValueError(f"No policy network found under {scope!r} in {path}")
+    action_values = f"{scope}/action-distribution/action_values/action_values-linear"
+    arrays["action_weights"] = reader.get_tensor(f"{action_values}/weights")
+    arrays["action_bias"] = reader.get_tensor(f"{action_values}/bias")
+
+    np.savez(output, **arrays)
+    return Path(output)
+
+
+class NumpyPolicy:
+    """
+    Forward pass of an exported policy, usable in place of a tensorforce agent.
+    """
+
+    def __init__(self, path):
+        """
+
+        Parameters
+        ----------
+        path : Path, str
+            An exported .npz file, or the checkpoint directory holding policy.npz
+        """
+        path = Path(path)
+        if path.is_dir():
+            path = path / POLICY_FILE
+        with np.load(path) as arrays:
+            depth = sum(
+                key.startswith("layer") and key.endswith("_weights")
+                for key in arrays.files
+            )
+            self.layers = [
+                (arrays[f"layer{i}_weights"], arrays[f"layer{i}_bias"])
+                for i in range(depth)
+            ]
+            self.action_weights = arrays["action_weights"]
+            self.action_bias = arrays["action_bias"]
+            activation = str(arrays["activation"])
+        if activation != "tanh":
+            raise ValueError(f"Unsupported activation {activation!r}")
+        self.path = path
+
+    @property
+    def num_actions(self):
+        return len(self.action_bias)
+
+    def action_values(self, states):
+        """
+        Unnormalized action scores, shape (..., num_actions).
+        """
+        x = np.asarray(states, dtype=np.float32)
+        for weights, bias in self.layers:
+            x = np.tanh(x @ weights + bias)
+        return x @ self.action_weights + self.action_bias
+
+    def act(self, states, independent=True, deterministic=True, rng=None):
+        """
+        Choose actions the way tensorforce's ``agent.act`` does.
+
+        Parameters
+        ----------
+        states : array
+            A single state or a batch of states
+        independent : bool
+            Accepted for compatibility with ``agent.act``. There is no internal
+            state to update, so every call is independent.
+        deterministic : bool
+            Take the highest valued action. Otherwise sample from the softmax.
+        rng : np.random.Generator, None
+            Generator used when sampling
+
+        Returns
+        -------
+        An int for a single state, an array of ints for a batch
+        """
+        values = self.action_values(states)
+        if deterministic:
+            actions = np.argmax(values, axis=-1)
+        else:
+            if rng is None:
+                rng = np.random.default_rng()
+            # Gumbel-max trick: argmax(logits + Gumbel noise) samples the softmax
+            gumbel = -np.log(-np.log(rng.random(values.shape)))
+            actions = np.argmax(values + gumbel, axis=-1)
+        if actions.ndim == 0:
+            return int(actions)
+        return actions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export tensorforce policy weights for NumpyPolicy."
+    )
+    parser.add_argument("paths", nargs="+", help="checkpoint directories")
+    args = parser.parse_args(argv)
+    for path in args.paths:
+        print(export_policy(path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Running several racks at once, each on its own simulated hardware.
+
+Every rack gets its own sample motor, detector and RunEngine, and runs
+`bad_seed_plan` on its own thread. All racks share one agent through an
+`AgentService`, which gathers the decisions racks ask for at about the same time
+and answers them with a single ``act_batch`` call.
+
+    racks = [Rack(f"rack{i}", SampleLibrary(seed=i), delay=0.5) for i in range(4)]
+    report = run_racks(racks, RLAgent(9, path), max_shots=100)
+    print(report["shots_per_hour"])
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import queue
+import threading
+import time
+
+from bluesky import RunEngine
+import numpy as np
+
+from .adaptive_recommendations import BadSeedRecommender, bad_seed_plan
+from .generate_data import get_sample_library
+from .simulated_hardware import DiffractionDetector, SimulatedMotor
+
+
+class Rack:
+    """Simulated hardware for one rack: a sample motor and a detector."""
+
+    def __init__(self, name, library=None, *, delay=2):
+        """
+
+        Parameters
+        ----------
+        name : str
+            Prefix of the device names, and so of the event fields
+        library : SampleLibrary, None
+            Samples in the rack. Defaults to `get_sample_library()`.
+        delay : float
+            Simulated exposure time
+        """
+        self.name = name
+        self.library = get_sample_library() if library is None else library
+        self.sample_selector = SimulatedMotor(value=0, name=f"{name}_sample_selector")
+        self.detector = DiffractionDetector(
+            name=f"{name}_detector", sample_selector=self.sample_selector
+        )
+        self.detector.library = self.library
+        self.detector.delay = delay
+
+    def __len__(self):
+        return len(self.library)
+
+
+class AgentService:
+    """
+    One agent answering the decisions of several racks, in batches.
+
+    Instances are agents themselves: calling one with (x, y) blocks until the
+    decision is made. Requests are collected on a worker thread until
+    ``batch_size`` are waiting or ``max_wait`` seconds have passed since the
+    first, and then passed to the agent's ``act_batch`` in one go (or one at a
+    time, for agents without it).
+    """
+
+    def __init__(self, agent, *, batch_size=None, max_wait=0.005):
+        """
+
+        Parameters
+        ----------
+        agent : Callable[int, int] -> int
+            Agent shared by every rack, e.g. RLAgent
+        batch_size : int, None
+            Decide as soon as this many requests are waiting, typically the
+            number of racks. None waits for ``max_wait`` every time.
+        max_wait : float
+            Longest a request waits for others to join its batch
+        """
+        self.agent = agent
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.num_samples = agent.num_samples
+        self.decisions = 0
+        self.batches = 0
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="agent-service", daemon=True
+        )
+        self._thread.start()
+
+    def __call__(self, x, y):
+        future = Future()
+        self._requests.put((x, y, future))
+        return future.result()
+
+    @property
+    def mean_batch_size(self):
+        return self.decisions / self.batches if self.batches else 0
+
+    def close(self):
+        """Stop the worker thread once the requests already made are answered."""
+        self._requests.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _collect(self):
+        """Wait for a request, then gather the ones that follow it quickly."""
+        first = self._requests.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while self.batch_size is None or len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                self._requests.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            xs, ys, futures = zip(*batch)
+            try:
+                if hasattr(self.agent, "act_batch"):
+                    decisions = self.agent.act_batch(np.array(xs), np.array(ys))
+                else:
+                    decisions = [self.agent(x, y) for x, y in zip(xs, ys)]
+            except Exception as exc:
+                for future in futures:
+                    future.set_exception(exc)
+            else:
+                for future, decision in zip(futures, decisions):
+                    future.set_result(int(decision))
+            self.decisions += len(batch)
+            self.batches += 1
+
+
+def run_racks(
+    racks,
+    agent,
+    max_shots=50,
+    *,
+    pipelined=True,
+    recommender_class=BadSeedRecommender,
+    max_wait=0.005,
+):
+    """
+    Run `bad_seed_plan` on several racks at once, sharing one agent.
+
+    Parameters
+    ----------
+    racks : List[Rack]
+        Each must hold as many samples as the agent was made for.
+    agent : Callable[int, int] -> int
+        Agent shared through an `AgentService`
+    max_shots : int
+        Shot budget of each rack
+    pipelined : bool
+        See `bad_seed_plan`
+    recommender_class : type
+        Recommender of each rack
+    max_wait : float
+        See `AgentService`
+
+    Returns
+    -------
+    report : dict
+        Shots, elapsed seconds and shots per hour for every rack (under
+        "racks") and across all of them, plus the mean batch size the agent
+        saw.
+    """
+    for rack in racks:
+        if len(rack) != agent.num_samples:
+            raise ValueError(
+                f"Rack {rack.name} holds {len(rack)} samples, "
+                f"but the agent is for {agent.num_samples}"
+            )
+
+    def run(rack, service):
+        RE = RunEngine(context_managers=[])
+        shots = 0
+
+        def count_shots(name, doc):
+            nonlocal shots
+            if name == "event":
+                shots += 1
+
+        RE.subscribe(count_shots)
+        start = time.monotonic()
+        RE(
+            bad_seed_plan(
+                rack.sample_selector,
+                rack.detector,
+                f"{rack.detector.name}_signal_to_noise",
+                list(range(len(rack))),
+                service,
+                max_shots,
+                recommender_class=recommender_class,
+                pipelined=pipelined,
+            )
+        )
+        elapsed = time.monotonic() - start
+        return dict(shots=shots, elapsed=elapsed, shots_per_hour=3600 * shots / elapsed)
+
+    start = time.monotonic()
+    with AgentService(agent, batch_size=len(racks), max_wait=max_wait) as service:
+        with ThreadPoolExecutor(len(racks), thread_name_prefix="rack") as pool:
+            futures = {rack.name: pool.submit(run, rack, service) for rack in racks}
+            results = {name: future.result() for name, future in futures.items()}
+    elapsed = time.monotonic() - start
+
+    shots = sum(result["shots"] for result in results.values())
+    return dict(
+        racks=results,
+        shots=shots,
+        elapsed=elapsed,
+        shots_per_hour=3600 * shots / elapsed,
+        mean_batch_size=service.mean_batch_size,
+    )
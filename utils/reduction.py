@@ -0,0 +1,154 @@
+"""
+Reduction of detector frames to I(q) and a noise estimate.
+
+Every pixel is assigned once to its nearest point of the q grid, using the same
+radial geometry the simulated images are rendered with. Reducing a frame, or a
+whole batch of frames, is then two weighted ``np.bincount`` calls: one for the
+per-bin sums, giving I(q), and one for the per-bin sums of squares, giving the
+scatter of the pixels around their ring mean.
+"""
+
+import functools
+
+import numpy as np
+
+from .generate_data import radial_geometry
+
+
+class RadialReducer:
+    """
+    Azimuthal integration and noise estimation for frames of one shape.
+
+    The estimate is the amplitude of uniform noise that would explain the scatter
+    within the rings, sqrt(12 * variance). That is what the simulated detector
+    reports as ``signal_to_noise`` and what BadSeedRecommender thresholds.
+
+    Prefer `radial_reducer`, which caches instances per (shape, x) pair.
+    """
+
+    def __init__(self, x, shape):
+        """
+
+        Parameters
+        ----------
+        x : array
+            q grid to integrate onto
+        shape : tuple
+            Shape of the frames
+        """
+        geometry = radial_geometry(x, shape)
+        self.x = geometry.x
+        self.shape = geometry.shape
+        nearest = geometry.index + (geometry.weight >= 0.5)
+        self.bins = nearest.ravel().astype(np.intp)
+        self.counts = np.bincount(self.bins, minlength=len(self.x))
+        # degrees of freedom left after fitting one mean per occupied ring
+        self.dof = self.bins.size - np.count_nonzero(self.counts)
+        self._batch_bins = {1: self.bins}
+
+    def _bins(self, n_frames):
+        """Bin indices for a batch, with every frame getting its own bins."""
+        bins = self._batch_bins.get(n_frames)
+        if bins is None:
+            offsets = len(self.x) * np.arange(n_frames)[:, np.newaxis]
+            bins = (self.bins + offsets).ravel()
+            self._batch_bins = {1: self.bins, n_frames: bins}
+        return bins
+
+    def reduce(self, frames):
+        """
+        Reduce frames to I(q) and a noise estimate in one vectorized pass.
+
+        Parameters
+        ----------
+        frames : array
+            Shape ``shape`` or (n_frames, *shape)
+
+        Returns
+        -------
+        profile : array
+            Mean intensity per q bin, shape (len(x),) or (n_frames, len(x)).
+            Bins without pixels are 0.
+        noise_level : float or array
+            Estimated noise amplitude of each frame
+        """
+        frames = np.asarray(frames)
+        batch_shape = frames.shape[:-2]
+        values = frames.reshape(-1, self.bins.size)
+        n_frames, size = len(values), len(values) * len(self.x)
+        bins = self._bins(n_frames)
+
+        values = values.ravel()
+        sums = np.bincount(bins, values, minlength=size).reshape(n_frames, -1)
+        squares = np.bincount(bins, values * values, minlength=size)
+        squares = squares.reshape(n_frames, -1)
+
+        profile = np.divide(
+            sums, self.counts, out=np.zeros(sums.shape), where=self.counts > 0
+        )
+        # sum over bins of sum((v - mean) ** 2) = sum(v ** 2) - mean * sum(v)
+        scatter = (squares - profile * sums).sum(axis=1)
+        noise_level = np.sqrt(12 * np.maximum(scatter, 0) / self.dof)
+
+        profile = profile.reshape(*batch_shape, len(self.x))
+        if not batch_shape:
+            return profile, float(noise_level[0])
+        return profile, noise_level.reshape(batch_shape)
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_radial_reducer(shape, x_bytes):
+    return RadialReducer(np.frombuffer(x_bytes), shape)
+
+
+def radial_reducer(x, shape):
+    """
+    Return the (cached) RadialReducer for this q grid and frame shape.
+    """
+    x = np.ascontiguousarray(x, dtype=float)
+    return _cached_radial_reducer(tuple(shape), x.tobytes())
+
+
+def reduce_to_recommender(
+    recommender,
+    x,
+    *,
+    image_key="detector_image",
+    index_key="sample_selector",
+    to_index=int,
+):
+    """
+    A RunEngine callback that reduces the image of every event and tells the
+    recommender the estimated noise level of the sample it was taken on.
+
+    Parameters
+    ----------
+    recommender : BadSeedRecommender
+        Anything with ``tell_many(xs, ys)``
+    x : array
+        q grid to reduce onto
+    image_key : str
+        Event field holding the frame
+    index_key : str
+        Event field holding the sample position
+    to_index : Callable[float] -> int
+        Converts the position to a sample index, e.g. SamplePositions.to_index
+
+    Returns
+    -------
+    callback : Callable[str, dict]
+    """
+
+    def tell(positions, frames):
+        frames = np.asarray(frames)
+        _, noise_levels = radial_reducer(x, frames.shape[-2:]).reduce(frames)
+        xs = [to_index(position) for position in positions]
+        recommender.tell_many(xs, [(level,) for level in np.atleast_1d(noise_levels)])
+
+    def callback(name, doc):
+        if name == "event":
+            tell([doc["data"][index_key]], [doc["data"][image_key]])
+        elif name == "event_page":
+            tell(doc["data"][index_key], doc["data"][image_key])
+
+    return callback
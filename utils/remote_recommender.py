@@ -0,0 +1,269 @@
+"""
+A recommender that runs in a worker process.
+
+Agent inference (TensorFlow, for RLAgent) then never holds the GIL or the thread
+of the RunEngine. A local copy of the recommender, driven by a NaiveAgent,
+sees every reading too, so that when the worker is slow to answer (or still
+loading its model) there is a recommendation to fall back on straight away.
+
+    RE(bad_seed_plan(..., agent=RLAgent(9, path), remote=True))
+"""
+
+from functools import partial
+import itertools
+import logging
+import multiprocessing
+import time
+import weakref
+
+import numpy as np
+from bluesky_adaptive.recommendations import NoRecommendation
+
+from .adaptive_recommendations import BadSeedRecommender, NaiveAgent, RLAgent
+
+logger = logging.getLogger(__name__)
+
+
+def _given(agent, num_samples):
+    return agent
+
+
+def agent_factory(agent):
+    """
+    A picklable factory that gives the worker a copy of an agent.
+
+    An RLAgent is rebuilt from its checkpoint rather than pickled, as its
+    TensorFlow model cannot be. Other agents are pickled as they are, and
+    classes or partials, which already are factories, are passed through.
+    """
+    if isinstance(agent, (type, partial)):
+        return agent
+    if isinstance(agent, RLAgent):
+        return partial(
+            RLAgent, path=agent.path, backend=agent.backend, max_count=agent.max_count
+        )
+    return partial(_given, agent)
+
+
+def _serve(connection, num_samples, agent, recommender_class):
+    """
+    Worker process: build the recommender and answer requests in order.
+
+    Asks that have been overtaken by a newer one while the agent was busy are
+    skipped, as whoever sent them has already fallen back.
+    """
+    try:
+        recommender = recommender_class(
+            num_samples=num_samples, agent=agent(num_samples)
+        )
+    except Exception as exc:
+        connection.send(("failed", repr(exc)))
+        return
+    connection.send(("ready",))
+    while True:
+        try:
+            requests = [connection.recv()]
+            while connection.poll(0):
+                requests.append(connection.recv())
+        except EOFError:
+            return
+        last_ask = max(
+            (i for i, (command, *_) in enumerate(requests) if command == "ask"),
+            default=None,
+        )
+        for i, (command, *args) in enumerate(requests):
+            if command == "close":
+                return
+            elif command == "tell_many":
+                recommender.tell_many(*args)
+            elif command == "tell_pending":
+                recommender.tell_pending(*args)
+            elif command == "ask" and i == last_ask:
+                request_id, n, tell_pending = args
+                try:
+                    points = recommender.ask(n, tell_pending=tell_pending)
+                except NoRecommendation:
+                    connection.send(("no_recommendation", request_id))
+                except Exception as exc:
+                    connection.send(("error", request_id, repr(exc)))
+                else:
+                    connection.send(("ask", request_id, [int(p) for p in points]))
+
+
+def _shutdown(connection, process):
+    try:
+        connection.send(("close",))
+    except (BrokenPipeError, OSError):
+        pass
+    process.join(timeout=5)
+    if process.is_alive():
+        process.terminate()
+
+
+class RemoteRecommender:
+    """
+    BadSeedRecommender in a worker process, with a local NaiveAgent fallback.
+
+    Readings are sent to the worker without waiting. Each `ask` waits up to
+    ``timeout`` seconds for the worker's answer and otherwise answers from the
+    local fallback; late answers are dropped. The worker is shut down when the
+    recommender is closed or garbage collected.
+
+    If the worker cannot build its recommender, or exits before it is ready,
+    `ask` and `wait_ready` raise a RuntimeError rather than falling back. A
+    worker lost later on is logged, and the fallback takes over.
+    """
+
+    def __init__(
+        self,
+        num_samples,
+        agent,
+        *,
+        recommender_class=BadSeedRecommender,
+        timeout=0.5,
+        context="spawn",
+    ):
+        """
+
+        Parameters
+        ----------
+        num_samples : int
+        agent : Callable[int] -> agent
+            Picklable factory called in the worker with the number of samples,
+            e.g. ``NaiveAgent``, ``functools.partial(RLAgent, path=...)`` or
+            ``agent_factory(agent)`` for an agent already built
+        recommender_class : type
+            Recommender to run in the worker (and locally as the fallback)
+        timeout : float
+            Seconds `ask` waits for the worker before falling back
+        context : str
+            multiprocessing start method. "spawn" keeps TensorFlow and the
+            RunEngine's threads out of the worker.
+        """
+        self.num_samples = num_samples
+        self.timeout = timeout
+        self.fallback = recommender_class(
+            num_samples=num_samples, agent=NaiveAgent(num_samples)
+        )
+        self.ready = False
+        self.started = False
+        self.error = None
+        self.answered = 0
+        self.fallbacks = 0
+        self._request_ids = itertools.count()
+
+        ctx = multiprocessing.get_context(context)
+        self._connection, child = ctx.Pipe()
+        self._process = ctx.Process(
+            target=_serve,
+            args=(child, num_samples, agent, recommender_class),
+            name="remote-recommender",
+            daemon=True,
+        )
+        self._process.start()
+        child.close()
+        self._finalizer = weakref.finalize(
+            self, _shutdown, self._connection, self._process
+        )
+
+    def wait_ready(self, timeout=None):
+        """
+        Wait for the worker to have built its agent, and return whether it has.
+        Until then every `ask` is answered by the fallback.
+        """
+        if not self.ready:
+            self._receive(None, timeout)
+        self._check_started()
+        return self.ready
+
+    def close(self):
+        """Shut the worker down."""
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _check_started(self):
+        if self.error is not None:
+            raise RuntimeError(f"Remote recommender failed to start: {self.error}")
+
+    def _lost(self):
+        """The worker went away: a startup failure, or a loss to fall back from."""
+        if not self.started:
+            if self.error is None:
+                self._process.join(timeout=1)
+                self.error = f"worker exited with code {self._process.exitcode}"
+        elif self.ready:
+            logger.error("Remote recommender worker exited, using the fallback")
+        self.ready = False
+
+    def _send(self, *message):
+        try:
+            self._connection.send(message)
+        except (BrokenPipeError, OSError):
+            self._lost()
+
+    def _receive(self, request_id, timeout):
+        """
+        Return the worker's reply to request_id, or None if it does not come
+        within timeout (None waits forever). Late replies to earlier requests
+        are dropped.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._connection.poll(
+            None if deadline is None else max(deadline - time.monotonic(), 0)
+        ):
+            try:
+                reply = self._connection.recv()
+            except EOFError:
+                self._lost()
+                return None
+            if reply[0] == "failed":
+                self.error = reply[1]
+                return None
+            if reply[0] == "ready":
+                self.ready = self.started = True
+                if request_id is None:
+                    return reply
+            elif reply[1] == request_id:
+                return reply
+        return None
+
+    def tell_many(self, xs, ys):
+        xs = [int(np.asarray(x).ravel()[0]) for x in xs]
+        ys = [np.asarray(y, dtype=float).ravel().tolist() for y in ys]
+        self.fallback.tell_many(xs, ys)
+        self._send("tell_many", xs, ys)
+
+    def tell_pending(self, xs):
+        xs = [int(x) for x in xs]
+        self.fallback.tell_pending(xs)
+        self._send("tell_pending", xs)
+
+    def ask(self, n, tell_pending=True):
+        """
+        Ask the worker for the next n points, falling back to the local
+        recommender if it has not answered within the timeout.
+        """
+        if not self.ready:
+            self._receive(None, 0)
+        self._check_started()
+        reply = None
+        if self.ready:
+            request_id = next(self._request_ids)
+            self._send("ask", request_id, n, tell_pending)
+            reply = self._receive(request_id, self.timeout)
+
+        if reply is None or reply[0] == "error":
+            self.fallbacks += 1
+            return self.fallback.ask(n, tell_pending=tell_pending)
+        if reply[0] == "no_recommendation":
+            raise NoRecommendation
+        self.answered += 1
+        points = reply[2]
+        if tell_pending:
+            self.fallback.tell_pending(points)
+        return tuple(points)
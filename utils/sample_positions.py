@@ -0,0 +1,130 @@
+"""
+Mapping between lab-space motor positions and sample indices.
+"""
+
+import numpy as np
+
+
+class SamplePositions:
+    """
+    Indexed lookup of which sample sits at a motor position.
+
+    Positions on a single axis are kept sorted and looked up with
+    ``np.searchsorted``. Positions on several axes (e.g. the x/y stages under a
+    well plate) are looked up with scipy's ``cKDTree``. scipy is optional:
+    without it, the nearest sample is found with ``np.hypot.reduce`` over all
+    of them.
+
+    Integer positions are handed back as ints, so motors, and the documents
+    they are read into, keep an integer dtype.
+    """
+
+    def __init__(self, positions, tolerance=None):
+        """
+
+        Parameters
+        ----------
+        positions : array
+            Shape (num_samples,) for one motor, or (num_samples, num_axes) with
+            one column per motor.
+        tolerance : float, None
+            Largest distance a read-back position may be from the nearest sample.
+            Farther positions raise a ValueError. None accepts any distance.
+        """
+        given = np.array(positions)
+        if given.dtype.kind not in "iu":
+            given = given.astype(float)
+        positions = given.astype(float)
+        if positions.ndim == 1:
+            given = given[:, np.newaxis]
+            positions = positions[:, np.newaxis]
+        if positions.ndim != 2 or not len(positions):
+            raise ValueError("positions must have shape (N,) or (N, num_axes)")
+        self.positions = positions
+        # as given, for to_position
+        self._given = given
+        self.tolerance = tolerance
+
+        self._tree = None
+        if self.num_axes == 1:
+            self._order = np.argsort(positions[:, 0], kind="stable")
+            self._sorted = positions[self._order, 0]
+        else:
+            try:
+                from scipy.spatial import cKDTree
+            except ImportError:
+                pass
+            else:
+                self._tree = cKDTree(positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def num_axes(self):
+        return self.positions.shape[1]
+
+    def _nearest_1d(self, value):
+        i = np.searchsorted(self._sorted, value)
+        if i == len(self._sorted) or (
+            i > 0 and value - self._sorted[i - 1] <= self._sorted[i] - value
+        ):
+            i -= 1
+        return self._order[i], abs(self._sorted[i] - value)
+
+    def _nearest(self, pos):
+        if self._tree is not None:
+            distance, index = self._tree.query(pos)
+            return index, distance
+        distances = np.hypot.reduce(self.positions - pos, axis=1)
+        index = np.argmin(distances)
+        return index, distances[index]
+
+    def to_index(self, position):
+        """
+        Return the index of the sample nearest to a position.
+
+        Parameters
+        ----------
+        position : float or array
+            One value per axis. Arrays holding a single reading per axis, as
+            read back from a run, are accepted.
+
+        Raises
+        ------
+        ValueError
+            If the nearest sample is farther away than the tolerance.
+        """
+        pos = np.asarray(position, dtype=float).reshape(-1)
+        if len(pos) != self.num_axes:
+            raise ValueError(
+                f"Expected a position on {self.num_axes} axes, got {position!r}"
+            )
+        if self.num_axes == 1:
+            index, distance = self._nearest_1d(pos[0])
+        else:
+            index, distance = self._nearest(pos)
+        if self.tolerance is not None and distance > self.tolerance:
+            raise ValueError(
+                f"Position {position!r} is {distance:g} away from the nearest "
+                f"sample ({index}), more than the tolerance of {self.tolerance:g}"
+            )
+        return int(index)
+
+    def to_position(self, index, axis=None):
+        """
+        Return the lab-space position of a sample.
+
+        Parameters
+        ----------
+        index : int
+        axis : int, None
+            Which motor axis to return. None returns a number on a single axis
+            and an array on several.
+        """
+        row = self._given[int(index)]
+        if axis is not None:
+            return row[axis].item()
+        if self.num_axes == 1:
+            return row[0].item()
+        return row
@@ -1,44 +1,339 @@
+import heapq
+import itertools
+import logging
+from contextlib import contextmanager
 import threading
+import time
 
 import numpy
 import numpy as np
-from ophyd import Component, Device, Signal, DeviceStatus
+from ophyd import Component, Device, Kind, Signal, DeviceStatus
 from bluesky.plan_stubs import mv
 
-from .generate_data import generate_measured_image, SHAPE
+from .generate_data import (
+    generate_measured_image,
+    get_sample_library,
+    SHAPE,
+    x,
+)
+from .reduction import radial_reducer
 
+logger = logging.getLogger(__name__)
 
-sample_selector = Signal(value=0, name="sample_selector")
+
+class _Timer:
+    """A call waiting in a TimerScheduler, ordered by when it is due."""
+
+    __slots__ = ("deadline", "callback", "pending", "_seq")
+
+    def __init__(self, deadline, seq, callback):
+        self.deadline = deadline
+        self.callback = callback
+        self.pending = True  # False once it has fired or been cancelled
+        self._seq = seq
+
+    def __lt__(self, other):
+        return (self.deadline, self._seq) < (other.deadline, other._seq)
+
+    def __repr__(self):
+        return f"<_Timer deadline={self.deadline:.6f} callback={self.callback!r}>"
+
+
+class VirtualClock:
+    """
+    Simulated time, which only moves when it is advanced.
+
+    ``monotonic()`` counts the seconds simulated so far. ``time()`` is that
+    many seconds after ``start``, for use in timestamps.
+    """
+
+    def __init__(self, start=None):
+        self.start = time.time() if start is None else start
+        self.elapsed = 0.0
+
+    def monotonic(self):
+        return self.elapsed
+
+    def time(self):
+        return self.start + self.elapsed
+
+    def advance_to(self, elapsed):
+        self.elapsed = max(self.elapsed, elapsed)
+
+
+class TimerScheduler:
+    """
+    Call functions after a delay, all from one background thread.
+
+    Pending calls are kept in a heap keyed by their deadline, so scheduling and
+    cancelling are cheap and no thread is started per call. Callbacks run on the
+    scheduler thread one after the other and should return quickly.
+
+    With a VirtualClock in use (see `time_warp`) nothing fires on its own.
+    Instead `run_until` and `advance` jump the clock from one deadline to the
+    next and fire the timers from the calling thread.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.virtual_clock = None
+        self._heap = []
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def time(self):
+        """Time to stamp readings with, virtual while a VirtualClock is in use."""
+        if self.virtual_clock is None:
+            return time.time()
+        return self.virtual_clock.time()
+
+    def use_virtual_clock(self, virtual_clock):
+        """Switch to a VirtualClock, or back to real time with None."""
+        with self._condition:
+            if any(timer.pending for timer in self._heap):
+                raise RuntimeError("Cannot switch clocks while timers are pending")
+            self.virtual_clock = virtual_clock
+            if virtual_clock is None:
+                self.clock = time.monotonic
+            else:
+                self.clock = virtual_clock.monotonic
+            self._condition.notify()
+
+    def schedule(self, delay, callback):
+        """
+        Call ``callback()`` once ``delay`` seconds have passed.
+
+        Returns
+        -------
+        timer
+            Handle to pass to `cancel`
+        """
+        timer = _Timer(self.clock() + delay, next(self._seq), callback)
+        with self._condition:
+            heapq.heappush(self._heap, timer)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="timer-scheduler", daemon=True
+                )
+                self._thread.start()
+            if self._heap[0] is timer:
+                self._condition.notify()
+        return timer
+
+    def cancel(self, timer):
+        """Cancel a timer. Returns whether it was still pending."""
+        with self._condition:
+            pending, timer.pending = timer.pending, False
+            return pending
+
+    def pending(self):
+        """The timers that have neither fired nor been cancelled, soonest first."""
+        with self._condition:
+            return sorted(timer for timer in self._heap if timer.pending)
+
+    def _next_due(self):
+        with self._condition:
+            while True:
+                while self._heap and not self._heap[0].pending:
+                    heapq.heappop(self._heap)
+                if not self._heap or self.virtual_clock is not None:
+                    self._condition.wait()
+                    continue
+                wait = self._heap[0].deadline - self.clock()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                timer = heapq.heappop(self._heap)
+                timer.pending = False
+                return timer
+
+    def _fire(self, timer):
+        try:
+            timer.callback()
+        except Exception:
+            logger.exception("Timer callback %r failed", timer.callback)
+
+    def _run(self):
+        while True:
+            self._fire(self._next_due())
+
+    def _fire_next(self, until=None):
+        """
+        Jump the virtual clock to the soonest timer and fire it, unless there is
+        none due by ``until``. Returns whether a timer was fired.
+        """
+        with self._condition:
+            while self._heap and not self._heap[0].pending:
+                heapq.heappop(self._heap)
+            if not self._heap or (until is not None and self._heap[0].deadline > until):
+                return False
+            timer = heapq.heappop(self._heap)
+            timer.pending = False
+            self.virtual_clock.advance_to(timer.deadline)
+        self._fire(timer)
+        return True
+
+    def run_until(self, statuses):
+        """
+        In virtual time, fire timers in order until all statuses are done or no
+        timers are left.
+        """
+        while not all(status.done for status in statuses):
+            if not self._fire_next():
+                break
+
+    def advance(self, seconds):
+        """In virtual time, let seconds pass, firing the timers due meanwhile."""
+        until = self.clock() + seconds
+        while self._fire_next(until):
+            pass
+        self.virtual_clock.advance_to(until)
+
+
+# Shared by every simulated device
+timer_scheduler = TimerScheduler()
 
 
 class TimerStatus(DeviceStatus):
     """Simulate the time it takes for a detector to acquire an image."""
 
-    def __init__(self, device, delay):
+    def __init__(self, device, delay, *, scheduler=None):
         super().__init__(device)
         self.delay = delay  # for introspection purposes
-        threading.Timer(delay, self.set_finished).start()
+        self.scheduler = timer_scheduler if scheduler is None else scheduler
+        self.timer = self.scheduler.schedule(delay, self.set_finished)
+
+    @property
+    def remaining(self):
+        """Seconds until the status finishes, 0 once it is no longer pending."""
+        if not self.timer.pending:
+            return 0
+        return max(self.timer.deadline - self.scheduler.clock(), 0)
+
+    def cancel(self):
+        """Stop waiting and fail the status. Returns whether it was still pending."""
+        if not self.scheduler.cancel(self.timer):
+            return False
+        self.set_exception(RuntimeError(f"{self.device.name} acquisition cancelled"))
+        return True
+
+
+class SimulatedMotor(Signal):
+    """
+    A Signal standing in for a motor, whose moves take `delay` seconds.
+
+    The value changes at once; the status of ``set`` finishes after the delay,
+    timed by the timer scheduler. Readings are stamped with its time.
+    """
+
+    def __init__(self, *args, delay=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delay = delay
+
+    def put(self, value, *, timestamp=None, **kwargs):
+        if timestamp is None:
+            timestamp = timer_scheduler.time()
+        super().put(value, timestamp=timestamp, **kwargs)
+
+    def set(self, value, **kwargs):
+        self.put(value)
+        return TimerStatus(self, self.delay)
+
+
+sample_selector = SimulatedMotor(value=0, name="sample_selector")
 
 
 class DiffractionDetector(Device):
     # exposure_time = Component(Signal, value=1)
     image = Component(Signal, value=numpy.zeros(SHAPE))
     signal_to_noise = Component(Signal, value=0)
+    # Azimuthal average of the image on the q grid, read in reduced_only mode
+    radial_profile = Component(Signal, value=numpy.zeros(len(x)), kind="omitted")
 
-
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, sample_selector=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.delay = 2  # simulated exposure time delay
+        # Motor whose position says which sample is in the beam. None follows
+        # the module-level sample_selector.
+        self.sample_selector = sample_selector
+        # Optional generate_data.NoiseGenerator (e.g. seeded or float32).
+        # Avoid pooled buffers here: emitted documents hold on to the array.
+        self.noise = None
+        # Optional generate_data.SampleLibrary; None follows get_sample_library().
+        self.library = None
+        self._status = None
+        # Readout of the image, applied in this order. See readout().
+        self.roi = None  # (row_start, row_stop, col_start, col_stop)
+        self.binning = 1  # average NxN blocks of pixels
+        self.dtype = None  # e.g. np.float32 or np.uint16, None keeps float64
+        # Report the noise level estimated from the frame, rather than the
+        # simulated one, as production has to (see reduction.RadialReducer).
+        self.estimate_snr = False
+
+    @property
+    def reduced_only(self):
+        """Read the SNR and the radial profile instead of the image."""
+        return self.image.kind == Kind.omitted
+
+    @reduced_only.setter
+    def reduced_only(self, reduced_only):
+        self.image.kind = Kind.omitted if reduced_only else Kind.normal
+        self.radial_profile.kind = Kind.normal if reduced_only else Kind.omitted
+
+    def readout(self, image):
+        """
+        Apply the region of interest, binning and dtype to a full image.
+
+        Binning drops the rows and columns that do not fill a whole block.
+        Integer dtypes round and clip to their range.
+        """
+        if self.roi is not None:
+            row_start, row_stop, col_start, col_stop = self.roi
+            image = image[row_start:row_stop, col_start:col_stop]
+        n = self.binning
+        if n > 1:
+            rows, cols = image.shape[0] // n, image.shape[1] // n
+            blocks = image[: rows * n, : cols * n].reshape(rows, n, cols, n)
+            image = blocks.mean(axis=(1, 3))
+        if self.dtype is not None:
+            dtype = np.dtype(self.dtype)
+            if dtype.kind in "iu":
+                info = np.iinfo(dtype)
+                image = np.clip(np.rint(image), info.min, info.max)
+            image = image.astype(dtype, copy=False)
+        return image
 
     def trigger(self):
         "Generate a simulated reading with noise for the current sample."
-        sample_number = sample_selector.get()
-        arr, snr = generate_measured_image(sample_number)
-        # Update the internal signal with a simulated image.
-        self.image.set(arr)
-        self.signal_to_noise.set(snr)
+        motor = self.sample_selector
+        if motor is None:
+            motor = sample_selector
+        sample_number = motor.get()
+        arr, snr = generate_measured_image(
+            sample_number, noise=self.noise, library=self.library
+        )
+        # Update the internal signal with a simulated image. put, unlike set,
+        # does not start a thread to wait for the value to settle.
+        timestamp = timer_scheduler.time()
+        if self.reduced_only or self.estimate_snr:
+            library = get_sample_library() if self.library is None else self.library
+            profile, noise_level = radial_reducer(library.x, arr.shape).reduce(arr)
+            if self.estimate_snr:
+                snr = noise_level
+        if self.reduced_only:
+            self.radial_profile.put(profile.astype(np.float32), timestamp=timestamp)
+        else:
+            self.image.put(self.readout(arr), timestamp=timestamp)
+        self.signal_to_noise.put(snr, timestamp=timestamp)
         # Simulate the exposure and readout time with a tunable "delay".
-        return TimerStatus(self, self.delay)
+        self._status = TimerStatus(self, self.delay)
+        return self._status
+
+    def stop(self, *, success=False):
+        if self._status is not None:
+            self._status.cancel()
+        super().stop(success=success)
 
     def collect_asset_docs(self):
         yield from []
@@ -49,3 +344,74 @@ detector = DiffractionDetector(name="detector")
 
 def select_sample(sample_number):
     yield from mv(sample_selector, sample_number)
+
+
+@contextmanager
+def time_warp(RE, *, start=None, scheduler=None):
+    """
+    Run the simulated hardware on a VirtualClock instead of sleeping.
+
+    Inside the block, whenever the RunEngine waits on statuses from the timer
+    scheduler, the clock jumps straight to their deadlines. Plan sleeps advance
+    the clock too. Readings of the simulated devices and the times of all
+    documents are stamped with virtual time, so an overnight scan replays as
+    fast as the documents can be processed. Only hardware time is simulated:
+    time spent computing between waits does not move the clock.
+
+        with time_warp(RE) as clock:
+            RE(with_agent(NaiveAgent(9), max_shots=18_000))
+        print(clock.elapsed / 3600, "hours")
+
+    Parameters
+    ----------
+    RE : bluesky.RunEngine
+    start : float, None
+        Virtual time at the start, as a Unix timestamp. Defaults to now.
+    scheduler : TimerScheduler, None
+        Defaults to the scheduler shared by the simulated devices.
+
+    Yields
+    ------
+    VirtualClock
+    """
+    scheduler = timer_scheduler if scheduler is None else scheduler
+    clock = VirtualClock(start)
+    scheduler.use_virtual_clock(clock)
+
+    previous_hook = RE.waiting_hook
+    process = RE.dispatcher.process
+    # an override already set on the instance (say by an outer time_warp)
+    previous_process = vars(RE.dispatcher).get("process")
+
+    def waiting_hook(statuses):
+        if previous_hook is not None:
+            previous_hook(statuses)
+        if statuses:
+            scheduler.run_until(statuses)
+
+    async def sleep(msg):
+        scheduler.advance(*msg.args)
+
+    def process_in_virtual_time(name, doc):
+        if name == "event_page":
+            doc["time"] = [clock.time()] * len(doc["time"])
+        elif "time" in doc:
+            doc["time"] = clock.time()
+        process(name, doc)
+
+    RE.waiting_hook = waiting_hook
+    RE.register_command("sleep", sleep)
+    RE.dispatcher.process = process_in_virtual_time
+    try:
+        yield clock
+    finally:
+        RE.waiting_hook = previous_hook
+        RE.register_command("sleep", RE._sleep)
+        if previous_process is None:
+            del RE.dispatcher.process
+        else:
+            RE.dispatcher.process = previous_process
+        # let anything left over finish, rather than hang forever
+        while scheduler._fire_next():
+            pass
+        scheduler.use_virtual_clock(None)
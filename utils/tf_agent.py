@@ -2,6 +2,7 @@
 # Full environment needed to initialize agent. A skeleton could be used, but nah tho.
 # Modified setup to remove some functionality like saving and GPU etc
 # Add load function
+from collections import deque
 from pathlib import Path
 
 import numpy as np
@@ -22,6 +23,7 @@ class CartSeed(Environment):
         bad_seed_reward_f=None,
         good_seed_reward_f=None,
         measurement_time=None,
+        trajectory_length=10_000,
     ):
         """
         Bad seeds, but make it cartpole...
@@ -51,7 +53,7 @@ class CartSeed(Environment):
             Visit the samples in sequential order, not randomly.
         revisiting: bool
             Whether to allow revisiting of past samples. Once all samples are visited, the memory resets.
-            The memory is a hashable set that gets emptied when its length reaches the seed count.
+            The memory is a boolean bitmap over the seeds that gets cleared on reset() or when it fills up.
             A possible update is to make this a terminal condition.
         bad_seed_reward: function
             Function of the form f(state, terminal, action). Where the state is the resultant state from the action.
@@ -61,6 +63,8 @@ class CartSeed(Environment):
             Override for max_episode_timesteps in Environment.create().
             Passing a value of max_episode_timesteps to Environment.create() will override measurement_time and the
             default max_episode_timesteps(), raising an UnexpectedError if the override value is greater than the others.
+        trajectory_length: int, None
+            Number of most recent positions kept in exp_sequence. None keeps everything.
         """
         super().__init__()
 
@@ -89,18 +93,60 @@ class CartSeed(Environment):
         self.sequential_order = bool(sequential)
         self.revisiting = bool(revisiting)
         self.measurement_time = measurement_time
-        self.visited = set()
         self.timestep = 0
 
+        # Visited memory: a bitmap, plus the unvisited indices packed at the front
+        # of _unvisited (with _slot locating each index in it) for O(1) sampling.
+        self.visited = np.zeros(seed_count, dtype=bool)
+        self._unvisited = np.arange(seed_count)
+        self._slot = np.arange(seed_count)
+        self._unvisited_count = seed_count
+
         self.seeds = np.empty((seed_count, 2))
         self.current_idx = None
-        self.exp_sequence = []
+        self.exp_sequence = deque(maxlen=trajectory_length)
 
         self.bad_seed_indicies = None
         self.good_seed_indicies = None
 
         self.rng = np.random.default_rng()
 
+    def _clear_visited(self):
+        self.visited[:] = False
+        self._unvisited_count = self.seed_count
+
+    def _swap_to_end(self, idx):
+        """Move an unvisited index to the last unvisited slot."""
+        last_slot = self._unvisited_count - 1
+        slot = self._slot[idx]
+        other = self._unvisited[last_slot]
+        self._unvisited[slot], self._unvisited[last_slot] = other, idx
+        self._slot[other], self._slot[idx] = slot, last_slot
+
+    def _mark_visited(self, idx):
+        if self.visited[idx]:
+            return
+        self.visited[idx] = True
+        self._swap_to_end(idx)
+        self._unvisited_count -= 1
+
+    def _all_visited(self, prev_index):
+        """Whether there is no unvisited seed to move to from prev_index."""
+        if self.visited[prev_index]:
+            return self._unvisited_count == 0
+        return self._unvisited_count <= 1
+
+    def _random_unvisited(self, prev_index):
+        """Uniformly pick an unvisited seed other than prev_index in O(1)."""
+        candidates = self._unvisited_count
+        if not self.visited[prev_index]:
+            # park prev_index just past the range we sample from
+            self._swap_to_end(prev_index)
+            candidates -= 1
+        if candidates == 0:
+            return prev_index
+        return self._unvisited[self.rng.integers(candidates)]
+
     def bad_seed_reward(self, state, terminal, action):
         """
         Functional approach to the bad seed reward
@@ -177,7 +223,8 @@ class CartSeed(Environment):
         State
         """
         self.timestep = 0
-        l = list(range(self.seed_count))
+        self._clear_visited()
+        l = np.arange(self.seed_count)
         if not self.frozen_order:
             self.rng.shuffle(l)
 
@@ -234,27 +281,23 @@ class CartSeed(Environment):
         prev_index = self.current_idx
         if move:
             # Clear previously visited or complete episode if all samples visited
-            if len(self.visited) == self.seed_count:
+            if self._all_visited(prev_index):
                 if not self.revisiting:
                     state = self.seeds[prev_index, :]
                     terminal = True
                     reward = self.good_seed_reward(state, terminal, actions)
                     return state, terminal, reward
                 else:
-                    self.visited = set()
+                    self._clear_visited()
             # Frozen order  and sequential order iterates
             if self.frozen_order or self.sequential_order:
                 self.current_idx = (self.current_idx + 1) % self.seed_count
             # Otherwise random change that hasn't been visited
             else:
-                self.current_idx = self.rng.integers(self.seed_count)
-                while (
-                    self.current_idx in self.visited or self.current_idx == prev_index
-                ):
-                    self.current_idx = self.rng.integers(self.seed_count)
+                self.current_idx = self._random_unvisited(prev_index)
         # Add to memory
         if not self.revisiting:
-            self.visited.add(self.current_idx)
+            self._mark_visited(self.current_idx)
 
         self.exp_sequence.append(self.current_idx)
         state = self.seeds[self.current_idx, :]
@@ -294,8 +337,9 @@ class CartSeedCountdown(CartSeed):
 
     def reset(self):
         super().reset()
-        for i in self.bad_seed_indicies:
-            self.seeds[i, 1] = self.rng.integers(1, self.max_count)
+        self.seeds[self.bad_seed_indicies, 1] = self.rng.integers(
+            1, self.max_count, size=len(self.bad_seed_indicies)
+        )
 
         # Always scales the reward such that the optimal performance is 100
         # Does this for defaults as well as calculating optimal points for input functions
@@ -362,27 +406,23 @@ class CartSeedCountdown(CartSeed):
         prev_index = self.current_idx
         if move:
             # Clear previously visited or complete episode if all samples visited
-            if len(self.visited) == self.seed_count:
+            if self._all_visited(prev_index):
                 if not self.revisiting:
                     state = np.array([self.seeds[prev_index, 1]])
                     terminal = True
                     reward = self.good_seed_reward(state, terminal, actions)
                     return state, terminal, reward
                 else:
-                    self.visited = set()
+                    self._clear_visited()
             # Frozen order  and sequential order iterates
             if self.frozen_order or self.sequential_order:
                 self.current_idx = (self.current_idx + 1) % self.seed_count
             # Otherwise random change that hasn't been visited
             else:
-                self.current_idx = self.rng.integers(self.seed_count)
-                while (
-                    self.current_idx in self.visited or self.current_idx == prev_index
-                ):
-                    self.current_idx = self.rng.integers(self.seed_count)
+                self.current_idx = self._random_unvisited(prev_index)
         # Add to memory
         if not self.revisiting:
-            self.visited.add(self.current_idx)
+            self._mark_visited(self.current_idx)
 
         self.exp_sequence.append(self.current_idx)
         state = np.array([self.seeds[self.current_idx, 1]])
@@ -0,0 +1,328 @@
+"""
+Batched versions of the CartSeed environments from `tf_agent`.
+
+These step N independent environments at once with array operations and do not
+need tensorforce, so they can be used for fast rollouts and evaluation.
+"""
+
+import numpy as np
+
+
+def _constant_reward(value):
+    def reward_f(states, terminals, actions):
+        return np.full(len(states), value, dtype=float)
+
+    return reward_f
+
+
+class VectorCartSeed:
+    # CartSeed hands back a view of its seeds, so the state reflects the
+    # countdown after the shot; CartSeedCountdown hands back a copy from before.
+    _state_after_shot = True
+
+    def __init__(
+        self,
+        num_envs,
+        seed_count,
+        *,
+        bad_seed_count=None,
+        max_count=10,
+        frozen_order=False,
+        sequential=False,
+        revisiting=True,
+        bad_seed_reward_f=None,
+        good_seed_reward_f=None,
+        measurement_time=None,
+        seed=None,
+    ):
+        """
+        N copies of CartSeed held as (N, seed_count, 2) arrays and stepped together.
+
+        The game is the same as CartSeed; see there for the meaning of the shared
+        parameters. Environments do not reset themselves when they reach a terminal
+        state, use ``reset(mask)`` to restart the ones that finished.
+
+        Two deliberate differences from the scalar environment:
+            - the memory of visited seeds is cleared on reset
+            - with revisiting=False, a move with no unvisited seed left (other than
+              the current one) ends the episode instead of searching forever
+
+        Parameters
+        ----------
+        num_envs: int
+            Number of environments
+        seed_count: int
+            Number of total seeds
+        bad_seed_count: int, None
+            Number of bad seeds. If None, a variable amount will be used for each reset.
+        max_count: int
+            Maximum number of samples/scans needed to saturate a bad_seed
+        frozen_order: bool
+            Locks the order of the seeds and order of the sampling. Bad seeds are the first set of seeds.
+        sequential: bool
+            Visit the samples in sequential order, not randomly.
+        revisiting: bool
+            Whether to allow revisiting of past samples.
+        bad_seed_reward_f: function
+            Vectorized function of the form f(states, terminals, actions) where states has shape
+            (k, 2), returning a scalar or shape (k,) rewards.
+        good_seed_reward_f: function
+            Vectorized function of the same form as bad_seed_reward_f.
+        measurement_time: int, None
+            Episode length. If None, the maximum possible score plus the required moves.
+        seed: int, None
+            Seed for the random number generator shared by all environments.
+        """
+        if bad_seed_count is None:
+            self.variable_bad_seed = True
+        elif bad_seed_count > seed_count:
+            raise ValueError("bad_seed_count must be less than or equal to seed_count")
+        else:
+            self.variable_bad_seed = False
+
+        self.num_envs = num_envs
+        self.seed_count = seed_count
+        if bad_seed_reward_f is None:
+            bad_seed_reward_f = _constant_reward(1)
+        self._bad_seed_reward_f = bad_seed_reward_f
+        if good_seed_reward_f is None:
+            good_seed_reward_f = _constant_reward(0)
+        self._good_seed_reward_f = good_seed_reward_f
+
+        self.max_count = max_count
+        self.frozen_order = bool(frozen_order)
+        self.sequential_order = bool(sequential)
+        self.revisiting = bool(revisiting)
+        self.measurement_time = measurement_time
+
+        self.bad_seed_count = np.full(num_envs, bad_seed_count or 0, dtype=int)
+        self.reward_scale = np.ones(num_envs)
+        self.seeds = np.zeros((num_envs, seed_count, 2))
+        self.current_idx = np.zeros(num_envs, dtype=int)
+        self.timestep = np.zeros(num_envs, dtype=int)
+        self.visited = np.zeros((num_envs, seed_count), dtype=bool)
+
+        self.rng = np.random.default_rng(seed)
+
+    def states(self):
+        """
+        State is current seed [bool(bad), countdown]
+
+        Returns
+        -------
+        state specification
+        """
+        return dict(type="float", shape=(2,))
+
+    def actions(self):
+        """
+        Actions specification: Stay or go
+        Returns
+        -------
+        Action spec
+        """
+        return dict(type="int", num_values=2)
+
+    def max_episode_timesteps(self):
+        """
+        Returns
+        -------
+        Episode length of each environment, shape (N,)
+        """
+        if self.measurement_time is None:
+            return self.max_count * self.bad_seed_count + self.seed_count
+        else:
+            return np.full(self.num_envs, self.measurement_time)
+
+    def _reward(self, reward_f, states, terminals, actions):
+        return np.broadcast_to(reward_f(states, terminals, actions), len(states))
+
+    def _observe(self, envs):
+        return self.seeds[envs, self.current_idx[envs]].copy()
+
+    def _point_max(self, envs):
+        """Score of a perfect episode before rescaling, for each env in envs."""
+        countdown = np.arange(self.max_count, 0, -1)
+        states = np.stack([np.ones_like(countdown), countdown], axis=1)
+        per_seed = self._reward(self._bad_seed_reward_f, states, None, None).sum()
+        return per_seed * self.bad_seed_count[envs]
+
+    def reset(self, mask=None):
+        """
+        Reset all environments, or only those selected by a boolean mask.
+
+        Parameters
+        ----------
+        mask: array, None
+            Boolean array of shape (N,) selecting the environments to reset.
+
+        Returns
+        -------
+        States of all environments, shape (N, 2)
+        """
+        if mask is None:
+            envs = np.arange(self.num_envs)
+        else:
+            envs = np.flatnonzero(mask)
+        k = len(envs)
+        self.timestep[envs] = 0
+        self.visited[envs] = False
+
+        if self.variable_bad_seed:
+            self.bad_seed_count[envs] = self.rng.integers(self.seed_count, size=k)
+
+        # rank of each seed in the (shuffled) order; the lowest ranks are bad
+        if self.frozen_order:
+            rank = np.broadcast_to(np.arange(self.seed_count), (k, self.seed_count))
+        else:
+            rank = self.rng.random((k, self.seed_count)).argsort(axis=1).argsort(axis=1)
+        bad = rank < self.bad_seed_count[envs, np.newaxis]
+        self.seeds[envs, :, 0] = bad
+        self.seeds[envs, :, 1] = bad * self.max_count
+
+        # Always scales the reward such that the optimal performance is 100
+        point_max = self._point_max(envs)
+        self.reward_scale[envs] = np.where(
+            self.bad_seed_count[envs] > 0, 100 / np.where(point_max, point_max, 1), 1
+        )
+
+        self.current_idx[envs] = self.rng.integers(self.seed_count, size=k)
+        return self._observe(np.arange(self.num_envs))
+
+    def _move(self, envs, prev):
+        """Pick the next index for the environments in envs that chose to move."""
+        if self.frozen_order or self.sequential_order:
+            return (prev + 1) % self.seed_count
+        if self.revisiting:
+            # uniform over every seed except the current one
+            offset = 1 + self.rng.integers(max(self.seed_count - 1, 1), size=len(envs))
+            return (prev + offset) % self.seed_count
+        candidates = ~self.visited[envs]
+        candidates[np.arange(len(envs)), prev] = False
+        pick = self.rng.integers(candidates.sum(axis=1))
+        return np.argmax(np.cumsum(candidates, axis=1) > pick[:, np.newaxis], axis=1)
+
+    def _is_bad(self, states):
+        return (states[:, 0] != 0) & (states[:, 1] > 0)
+
+    def execute(self, actions):
+        """
+        Step every environment.
+
+        Parameters
+        ----------
+        actions: array
+            Shape (N,) of bool/int, whether each environment moves on.
+
+        Returns
+        -------
+        next_states: array, shape (N, 2)
+        terminals: array of bool, shape (N,)
+        rewards: array of float, shape (N,)
+        """
+        actions = np.broadcast_to(np.asarray(actions), (self.num_envs,))
+        move = actions.astype(bool)
+        all_envs = np.arange(self.num_envs)
+        self.timestep += 1
+        prev = self.current_idx.copy()
+
+        # Complete the episode if there is nowhere left to go
+        if self.revisiting:
+            exhausted = np.zeros(self.num_envs, dtype=bool)
+        else:
+            unvisited = ~self.visited
+            unvisited[all_envs, prev] = False
+            exhausted = move & ~unvisited.any(axis=1)
+
+        moving = np.flatnonzero(move & ~exhausted)
+        if len(moving):
+            self.current_idx[moving] = self._move(moving, prev[moving])
+        if not self.revisiting:
+            self.visited[all_envs, self.current_idx] = True
+
+        states = self._observe(all_envs)
+        terminals = self.timestep >= self.max_episode_timesteps()
+        terminals |= exhausted
+
+        observed = self._state_view(states)
+        bad = self._is_bad(states) & ~exhausted
+        rewards = np.where(
+            bad,
+            self._reward(self._bad_seed_reward_f, observed, terminals, actions)
+            * self.reward_scale,
+            self._reward(self._good_seed_reward_f, observed, terminals, actions),
+        )
+
+        stepped = np.flatnonzero(~exhausted)
+        self.seeds[stepped, self.current_idx[stepped], 1] -= 1
+        if self._state_after_shot:
+            states[stepped, 1] -= 1
+        return observed, terminals, rewards
+
+    def _state_view(self, states):
+        return states
+
+
+class VectorCartSeedCountdown(VectorCartSeed):
+    """
+    VectorCartSeed with a variable countdown per bad seed and no boolean in state,
+    the batched counterpart of CartSeedCountdown.
+
+    Reward functions receive the (k, 1) countdown states, and the countdowns of
+    the bad seeds when rescaling on reset.
+    """
+
+    _state_after_shot = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.total_max_count = np.zeros(self.num_envs)
+
+    def states(self):
+        """
+        State is current seed [countdown]
+
+        Returns
+        -------
+        state specification
+        """
+        return dict(type="float", shape=(1,))
+
+    def max_episode_timesteps(self):
+        """
+        Returns
+        -------
+        Episode length of each environment, shape (N,)
+        """
+        if self.measurement_time is None:
+            return self.total_max_count + self.seed_count
+        else:
+            return np.full(self.num_envs, self.measurement_time)
+
+    def reset(self, mask=None):
+        super().reset(mask)
+        if mask is None:
+            envs = np.arange(self.num_envs)
+        else:
+            envs = np.flatnonzero(mask)
+        bad = self.seeds[envs, :, 0] != 0
+        countdown = self.rng.integers(1, self.max_count, size=bad.shape)
+        self.seeds[envs, :, 1] = np.where(bad, countdown, 0)
+
+        # Always scales the reward such that the optimal performance is 100
+        env_of, seed_of = np.nonzero(bad)
+        counts = self.seeds[envs[env_of], seed_of, 1]
+        points = self._reward(self._bad_seed_reward_f, counts, None, None) * counts
+        point_max = np.bincount(env_of, weights=points, minlength=len(envs))
+        self.reward_scale[envs] = np.where(
+            self.bad_seed_count[envs] > 0, 100 / np.where(point_max, point_max, 1), 1
+        )
+
+        self.total_max_count[envs] = self.seeds[envs, :, 1].sum(axis=1)
+        return self._state_view(self._observe(np.arange(self.num_envs)))
+
+    def _is_bad(self, states):
+        return states[:, 1] > 0
+
+    def _state_view(self, states):
+        return states[:, 1:]
@@ -1,13 +1,109 @@
-from collections import Counter
+import time
 
-from bluesky_live.bluesky_run import BlueskyRun, DocumentCache
-from bluesky_widgets.utils.streaming import stream_documents_into_runs
 import numpy as np
 
 from .simulated_hardware import SHAPE
 
 
-def stream_to_figures(fig, axes_list, start_at=0):
+def _normalized(img):
+    img = np.array(img, dtype=float)
+    img -= img.min()
+    img /= img.max()
+    return img
+
+
+def _throttled_callback(update, redraw, max_fps, new_timer=None):
+    """
+    A RunEngine callback passing each event's sample, image and SNR to
+    ``update``, and calling ``redraw`` at most ``max_fps`` times per second.
+
+    Canvases that draw synchronously get at most a fifth of the time. A redraw
+    held back when a run stops is left to a single-shot timer from
+    ``new_timer``, if given, or to the callback's ``flush()``.
+    """
+    next_draw = -np.inf
+    timer = None
+
+    def throttled_redraw():
+        nonlocal next_draw
+        start = time.monotonic()
+        redraw()
+        end = time.monotonic()
+        next_draw = end + max(1 / max_fps, 4 * (end - start))
+
+    def flush():
+        nonlocal timer
+        if timer is not None:
+            timer.stop()
+            timer = None
+        throttled_redraw()
+
+    def schedule_flush():
+        nonlocal timer
+        if timer is not None or new_timer is None:
+            return
+        delay = max(next_draw - time.monotonic(), 0)
+        timer = new_timer(interval=int(1000 * delay) + 1)
+        timer.single_shot = True
+        timer.add_callback(flush)
+        timer.start()
+
+    def callback(name, doc):
+        if name == "event":
+            data = doc["data"]
+            update(
+                int(data["sample_selector"]),
+                data["detector_image"],
+                data.get("detector_signal_to_noise"),
+            )
+        elif name == "event_page":
+            data = doc["data"]
+            snrs = data.get("detector_signal_to_noise", [None] * len(doc["seq_num"]))
+            for sample, img, snr in zip(
+                data["sample_selector"], data["detector_image"], snrs
+            ):
+                update(int(sample), img, snr)
+        elif name == "stop":
+            if time.monotonic() >= next_draw:
+                flush()
+            else:
+                schedule_flush()
+            return
+        else:
+            return
+        if time.monotonic() >= next_draw:
+            flush()
+
+    callback.flush = flush
+    return callback
+
+
+def stream_to_figures(fig, axes_list, start_at=0, *, max_fps=10):
+    """
+    Live view of the average image of each sample, as a RunEngine callback.
+
+    Every event updates a running mean kept in a preallocated buffer, using
+    only that event's data. Redraws are coalesced to at most ``max_fps`` per
+    second and, where the canvas supports it, only the panels that changed are
+    blitted. Whatever is left is drawn by a timer once the next redraw is due,
+    or at once by ``callback.flush()``.
+
+    Parameters
+    ----------
+    fig : matplotlib.figure.Figure
+    axes_list : array of Axes
+        One panel per sample, starting at sample ``start_at``. With a single
+        panel, it shows whichever sample is being measured.
+    start_at : int, optional
+        Sample shown in the first panel
+    max_fps : float, optional
+        Most redraws per second
+
+    Returns
+    -------
+    callback : Callable[str, dict]
+        With a ``flush()`` method drawing any pending update.
+    """
     fig.patch.set_alpha(0.5)
     axes_list = axes_list.ravel()
 
@@ -23,43 +119,223 @@ def stream_to_figures(fig, axes_list, start_at=0):
         sample_text = "S"  # abbreviate for space
     else:
         sample_text = "Sample "
+    titles = []
     for j, ax in enumerate(axes_list):
-        ax.set_title(f"{sample_text}{j + start_at} N_shots: 0")
+        titles.append(ax.set_title(f"{sample_text}{j + start_at} N_shots: 0"))
         ax.axis("off")
-    counts = Counter()
 
+    # running mean image and shot count per panel
+    means = np.zeros((len(ims), *SHAPE))
+    counts = np.zeros(len(ims), dtype=int)
+    dirty = set()
     last_seen = None
+    blit = getattr(fig.canvas, "supports_blit", False)
+    backgrounds = {}
 
-    def update_plot(event):
-        nonlocal last_seen
-        run = event.run
-        (sample,) = run.primary.read()["sample_selector"]
-        sample = int(sample)
-        img = run.primary.read()["detector_image"].mean(axis=0)
-        img -= img.min()
-        img /= img.max()
+    if blit:
+        for im, title in zip(ims, titles):
+            im.set_animated(True)
+            title.set_animated(True)
+
+        def save_backgrounds(event):
+            backgrounds.clear()
+            renderer = fig.canvas.get_renderer()
+            for j, ax in enumerate(axes_list):
+                bbox = ax.get_tightbbox(renderer).expanded(1.05, 1.05)
+                backgrounds[j] = (bbox, fig.canvas.copy_from_bbox(bbox))
+                ax.draw_artist(ims[j])
+                ax.draw_artist(titles[j])
+
+        fig.canvas.mpl_connect("draw_event", save_backgrounds)
+
+    def redraw():
+        if not dirty:
+            return
+        if not blit or len(backgrounds) != len(ims):
+            fig.canvas.draw_idle()
+        else:
+            for j in dirty:
+                bbox, background = backgrounds[j]
+                fig.canvas.restore_region(background)
+                axes_list[j].draw_artist(ims[j])
+                axes_list[j].draw_artist(titles[j])
+                fig.canvas.blit(bbox)
+            fig.canvas.flush_events()
+        dirty.clear()
+
+    def update(sample, img, snr):
+        nonlocal last_seen, means
+        img = _normalized(img)
 
         if len(ims) == 1:
-            (im,) = ims
+            j = 0
             if sample != last_seen:
-                counts.clear()
+                counts[0] = 0
         else:
-            im = ims[int(sample) - start_at]
+            j = sample - start_at
+            if not 0 <= j < len(ims):
+                return
+        if means.shape[1:] != img.shape:
+            # e.g. a binned or cropped readout
+            means = np.zeros((len(ims), *img.shape))
+            counts[:] = 0
 
-        prev_count = counts[sample]
-        old_data = im.get_array()
+        counts[j] += 1
+        means[j] += (img - means[j]) / counts[j]
 
-        new_data = (old_data * prev_count + img) / (prev_count + 1)
+        ims[j].set_data(means[j])
+        titles[j].set_text(f"{sample_text}{sample} N_shots: {counts[j]}")
+        dirty.add(j)
+        last_seen = sample
 
-        counts[sample] += 1
+    return _throttled_callback(update, redraw, max_fps, fig.canvas.new_timer)
 
-        im.set_data(new_data)
-        im.axes.set_title(f"{sample_text}{sample} N_shots: {counts[sample]}")
 
-        last_seen = sample
+def stream_to_mosaic(
+    fig,
+    num_samples,
+    start_at=0,
+    *,
+    tile_shape=(32, 32),
+    columns=None,
+    overlay="shots",
+    max_fps=10,
+):
+    """
+    Live view of a whole rack as one tiled image, as a RunEngine callback.
+
+    The average image of every sample is downsampled into its tile of a single
+    canvas array, which is updated in place, so a refresh costs one image
+    update however many samples there are. Refreshes are throttled like
+    `stream_to_figures`. A translucent heatmap of the shots
+    taken, or the mean SNR, of each sample is laid over the tiles. Clicking a
+    tile shows that sample at full resolution in the side panel.
+
+    Parameters
+    ----------
+    fig : matplotlib.figure.Figure
+        An empty figure to draw into
+    num_samples : int
+        Number of tiles
+    start_at : int, optional
+        Sample shown in the first tile
+    tile_shape : tuple, optional
+        Size of each tile in pixels. Images are averaged down in blocks.
+    columns : int, optional
+        Tiles per row. Defaults to a roughly square mosaic.
+    overlay : {"shots", "snr", None}, optional
+        What the heatmap shows
+    max_fps : float, optional
+        Most redraws per second
+
+    Returns
+    -------
+    callback : Callable[str, dict]
+        With a ``flush()`` method drawing any pending update.
+    """
+    if overlay not in ("shots", "snr", None):
+        raise ValueError(f"overlay must be 'shots', 'snr' or None, not {overlay!r}")
+    fig.patch.set_alpha(0.5)
+    if columns is None:
+        columns = int(np.ceil(np.sqrt(num_samples)))
+    rows = int(np.ceil(num_samples / columns))
+    th, tw = tile_shape
+
+    mosaic_ax, detail_ax = fig.subplots(
+        1, 2, gridspec_kw=dict(width_ratios=(3, 1)), squeeze=True
+    )
+    for ax in (mosaic_ax, detail_ax):
+        ax.axis("off")
+
+    # unmeasured tiles are NaN, so they stay blank
+    canvas = np.full((rows * th, columns * tw), np.nan)
+    mosaic = mosaic_ax.imshow(canvas, vmin=0, vmax=1, interpolation="nearest")
+    heat = np.full((rows, columns), np.nan)
+    heatmap = None
+    if overlay is not None:
+        heatmap = mosaic_ax.imshow(
+            heat,
+            extent=(-0.5, columns * tw - 0.5, rows * th - 0.5, -0.5),
+            cmap="magma",
+            alpha=0.35,
+            interpolation="nearest",
+        )
+    mosaic_ax.set_title(f"Samples {start_at}-{start_at + num_samples - 1}")
+    detail = detail_ax.imshow(np.zeros(SHAPE), vmin=0, vmax=1)
+    detail_ax.set_title("click a tile")
+
+    # full resolution running means, allocated as samples are first measured
+    means = {}
+    counts = np.zeros(num_samples, dtype=int)
+    snr_sums = np.zeros(num_samples)
+    selected = None
+    dirty = False
+
+    def tile(j):
+        row, col = divmod(j, columns)
+        return canvas[row * th : (row + 1) * th, col * tw : (col + 1) * tw]
+
+    def downsample(img):
+        fy, fx = max(img.shape[0] // th, 1), max(img.shape[1] // tw, 1)
+        # an image smaller than a tile (binned or cropped) only fills part of it
+        rows, cols = min(th, img.shape[0] // fy), min(tw, img.shape[1] // fx)
+        blocks = img[: rows * fy, : cols * fx].reshape(rows, fy, cols, fx)
+        return blocks.mean(axis=(1, 3))
+
+    def show_detail(j):
+        nonlocal selected
+        selected = j
+        if j in means:
+            detail.set_data(means[j])
+        else:
+            detail.set_data(np.full(detail.get_array().shape, np.nan))
+        detail_ax.set_title(f"Sample {j + start_at} N_shots: {counts[j]}")
+
+    def update(sample, img, snr):
+        nonlocal dirty
+        j = sample - start_at
+        if not 0 <= j < num_samples:
+            return
+        img = _normalized(img)
+        if j not in means or means[j].shape != img.shape:
+            means[j] = np.zeros(img.shape)
+            counts[j] = 0
+            snr_sums[j] = 0
+            tile(j)[:] = np.nan
+        counts[j] += 1
+        means[j] += (img - means[j]) / counts[j]
+        small = downsample(means[j])
+        tile(j)[: small.shape[0], : small.shape[1]] = small
+        if snr is not None:
+            snr_sums[j] += snr
+        if overlay == "shots":
+            heat.flat[j] = counts[j]
+        elif overlay == "snr":
+            heat.flat[j] = snr_sums[j] / counts[j]
+        if j == selected:
+            show_detail(j)
+        dirty = True
+
+    def redraw():
+        nonlocal dirty
+        if not dirty:
+            return
+        mosaic.set_data(canvas)
+        if heatmap is not None:
+            heatmap.set_data(heat)
+            heatmap.autoscale()
         fig.canvas.draw_idle()
+        dirty = False
 
-    def update_plot_on_stop(run):
-        run.events.completed.connect(update_plot)
+    def on_click(event):
+        if event.inaxes is not mosaic_ax or event.xdata is None:
+            return
+        col = int((event.xdata + 0.5) // tw)
+        row = int((event.ydata + 0.5) // th)
+        j = row * columns + col
+        if 0 <= col < columns and 0 <= j < num_samples:
+            show_detail(j)
+            fig.canvas.draw_idle()
 
-    return stream_documents_into_runs(update_plot_on_stop)
+    fig.canvas.mpl_connect("button_press_event", on_click)
+    return _throttled_callback(update, redraw, max_fps, fig.canvas.new_timer)